@@ -1,75 +1,576 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Tuple
+from contextlib import asynccontextmanager
+import asyncio
+import functools
+import hashlib
 import os
+import time
 
-import requests
 import json
 
 from google import genai
 
+from gemini_client import GeminiClient, GeminiError, GEMINI_BASE_URL
+from scenario_pool import ScenarioPool
+from transcripts import TranscriptStore, estimate_tokens
+from context_cache import ContextCache
+from session_store import SessionStore, InMemorySessionStore, SQLiteSessionStore
+from structured_output import gemini_schema, output_model, parse_structured
+import metrics
+from metrics import MetricsMiddleware, PromptLog
+from response_cache import ResponseCache, normalize_question
+from scheduler import BACKGROUND, CHAT, GROUND_TRUTH, PRIORITY_NAMES, STORY, ModelScheduler, SchedulerBusy, classify
+from speculation import Speculator
+from journal import SessionJournal
+from router import ModelRouter
+
 from prompts import (
     get_alternate_backstory_prompt, 
-    alternate_guilty_prompt,
+    alternate_guilty_prefix,
+    alternate_guilty_suffix,
     get_ground_truth_prompt,
-    alternate_innocent_prompt
+    alternate_innocent_prefix,
+    alternate_innocent_suffix,
+    get_summary_prompt,
+    get_json_repair_prompt,
+    scenario_fragments
 )
 
-user_data = {}
-
-# Initialize FastAPI app
-app = FastAPI()
-
 # Replace with your Google Gemini API key
 API_KEY = "UPDATE_API_KEY"
 os.environ["GEMINI_API_KEY"] = API_KEY
-client = genai.Client(api_key=API_KEY)
 
-def call_gemini(prompt: str, model: str="2.0-flash"):
-    headers = {
-        "Content-Type": "application/json"
-    }
-    API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-{model}:generateContent?key={API_KEY}"
+# Point GEMINI_API_ROOT at another server (e.g. benchmarks/fake_gemini.py) instead of the real API
+GEMINI_API_ROOT = os.environ.get("GEMINI_API_ROOT")
 
-    data = {
-        "contents": [
-            {"parts": [{"text": prompt}]}
-        ]
-    }
+if GEMINI_API_ROOT:
+    client = genai.Client(api_key=API_KEY, http_options=genai.types.HttpOptions(base_url=GEMINI_API_ROOT))
+else:
+    client = genai.Client(api_key=API_KEY)
 
-    response = requests.post(API_URL, headers=headers, json=data)
+# Shared async client: one keep-alive connection pool for every outbound model call
+gemini = GeminiClient(
+    api_key=API_KEY,
+    base_url=f"{GEMINI_API_ROOT}/v1beta" if GEMINI_API_ROOT else GEMINI_BASE_URL,
+    observer=metrics.observe_model_call,
+)
 
-    if response.status_code == 200:
-        try:
-            response_json = response.json()
-            # Debugging: Print API response to inspect structure
-            # print(json.dumps(response_json, indent=2))
-
-            # Extract response safely
-            if "candidates" in response_json and response_json["candidates"]:
-                return response_json["candidates"][0]["content"]["parts"][0]["text"]
-            else:
-                return "Error: API response is missing expected data."
-        except (KeyError, IndexError, json.JSONDecodeError) as e:
-            return f"Error: Unexpected response format - {str(e)}"
+# Opt-in sampled prompt log, written in the background: PROMPT_LOG_PATH=prompts.jsonl PROMPT_LOG_SAMPLE_RATE=0.05
+prompt_log = PromptLog(os.environ.get("PROMPT_LOG_PATH"), float(os.environ.get("PROMPT_LOG_SAMPLE_RATE", "0")))
+
+# Static per-(session, character) prompt prefixes registered with Gemini context caching
+CONTEXT_CACHE_TTL = 3600
+context_cache = ContextCache(client, ttl=CONTEXT_CACHE_TTL)
+
+# Per-call deadlines (seconds), including retries
+STORY_TIMEOUT = 60.0
+GROUND_TRUTH_TIMEOUT = 120.0
+CHAT_TIMEOUT = 30.0
+
+GROUND_TRUTH_MODEL = "2.5-flash-preview-04-17"
+CHAT_MODEL = "2.0-flash"
+FALLBACK_MODEL = "2.0-flash-lite"
+
+# Models per endpoint and minimum game difficulty, in order of preference; the row with the
+# highest minimum not above the game's difficulty applies, and later models are fallbacks
+# e.g. "chat": {1: [CHAT_MODEL, FALLBACK_MODEL], 8: [GROUND_TRUTH_MODEL, CHAT_MODEL]}
+MODEL_TABLE = {
+    "story": {1: [CHAT_MODEL, FALLBACK_MODEL]},
+    "ground_truth": {1: [GROUND_TRUTH_MODEL, CHAT_MODEL]},
+    "chat": {1: [CHAT_MODEL, FALLBACK_MODEL]},
+    "summary": {1: [CHAT_MODEL, FALLBACK_MODEL]},
+    "repair": {1: [CHAT_MODEL, FALLBACK_MODEL]},
+}
+# Seconds before a second, hedged request goes to the next model (only where latency matters)
+MODEL_HEDGE_AFTER = {"chat": 4.0}
+# Rolling p95 latency (seconds) past which a model is treated as degraded and routed around
+MODEL_SLOW_AFTER = {"story": 40.0, "ground_truth": 90.0, "chat": 10.0, "summary": 20.0, "repair": 20.0}
+router = ModelRouter(MODEL_TABLE, hedge_after=MODEL_HEDGE_AFTER, slow_after=MODEL_SLOW_AFTER)
+
+# Outbound model calls are queued by priority class (chat > ground truth > new stories > background)
+# and released within each model's per-minute quota: model -> (requests, tokens) per minute
+MODEL_RATE_LIMITS = {
+    CHAT_MODEL: (2000, 4000000),
+    GROUND_TRUTH_MODEL: (1000, 1000000),
+    FALLBACK_MODEL: (4000, 4000000),
+}
+# Each worker process keeps its own buckets, so the quota is split between the workers; uvicorn
+# takes its --workers default from WEB_CONCURRENCY, which keeps the two in step
+WORKER_COUNT = max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+# Calls allowed to wait per class before new ones are turned away with a 429
+SCHEDULER_MAX_QUEUE = {CHAT: 64, GROUND_TRUTH: 32, STORY: 32, BACKGROUND: 64}
+# Output tokens charged against the token bucket on top of the prompt
+EXPECTED_OUTPUT_TOKENS = 500
+scheduler = ModelScheduler(
+    max_concurrency=gemini.max_concurrency,
+    rate_limits={model: (rpm // WORKER_COUNT, tpm // WORKER_COUNT) for model, (rpm, tpm) in MODEL_RATE_LIMITS.items()},
+    max_queue=SCHEDULER_MAX_QUEUE,
+)
+
+# Set SESSION_DB to a SQLite path to share sessions between several uvicorn workers
+SESSION_DB = os.environ.get("SESSION_DB")
+
+# Session lifetime: idle sessions expire, and past MAX_SESSIONS the least recently used one is
+# evicted. Set SESSION_SPILL_DIR to write evicted sessions to disk and reload them on demand.
+SESSION_IDLE_TTL = 2 * 3600
+MAX_SESSIONS = 5000
+SESSION_SPILL_DIR = os.environ.get("SESSION_SPILL_DIR")
+SESSION_SWEEP_INTERVAL = 60
+# Set JOURNAL_DIR to journal every session change to disk so games survive a restart
+# (in-memory store only; the SQLite store is durable already)
+JOURNAL_DIR = os.environ.get("JOURNAL_DIR")
+JOURNAL_COMPACT_BYTES = 32 * 1024 * 1024
+JOURNAL_RETENTION = 30 * 24 * 3600
+# Number of turns kept in a session's full game history (prompts use the transcripts)
+HISTORY_LIMIT = 200
+
+# Answers to repeated questions (same scenario, character, question and transcript) are reused
+RESPONSE_CACHE_ENABLED = True
+RESPONSE_CACHE_SIZE = 10000
+# Exact matches only: rephrasings can be matched with ResponseCache(embed=..., similarity_threshold=...)
+# and a real embedding model, but a wrong reused answer breaks the game, so that is opt-in
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE)
+
+# Opt-in speculative answers to the questions players usually ask first, generated in the background
+LIKELY_QUESTIONS = [
+    "Where were you at the time of the murder?",
+    "How did you know the victim?",
+    "What did you see?",
+    "Did anyone have a reason to hurt the victim?",
+]
+SPECULATION_TOP_K = 2
+SPECULATION_TOKEN_BUDGET = 8000     # estimated prompt + answer tokens per session
+SPECULATION_ANSWER_TOKENS = 150
+SPECULATION_MAX_CONCURRENCY = 2
+SPECULATION_MAX_LOAD = 8            # other model calls in flight before speculation pauses
+SPECULATION_TAKE_TIMEOUT = 0.5      # longest a player waits on an in-flight speculation
+speculator = Speculator(
+    token_budget=SPECULATION_TOKEN_BUDGET,
+    max_concurrency=SPECULATION_MAX_CONCURRENCY,
+    max_load=SPECULATION_MAX_LOAD,
+    load=lambda: gemini.in_flight,
+    take_timeout=SPECULATION_TAKE_TIMEOUT,
+)
+
+# How often a worker checks the shared store for a ground truth another worker is generating
+GROUND_TRUTH_POLL_INTERVAL = 0.5
+
+# Per-character transcript budget (estimated tokens) before old turns are summarized
+TRANSCRIPT_TOKEN_BUDGET = 1500
+TRANSCRIPT_KEEP_RECENT = 4
+SUMMARY_TIMEOUT = 30.0
+REPAIR_TIMEOUT = 30.0
+
+# Pre-built scenarios kept ready for popular (difficulty, setting, murder_mode) combinations
+SCENARIO_POOL_TARGETS = {
+    (3, "supermarket", "poison"): 2,
+    (5, "movie theater", "stabbing"): 2,
+    (5, "swimming pool", "shooting"): 2,
+}
+# Players each pooled scenario is served to; games on the same scenario share cached answers
+SCENARIO_POOL_SHARES = 4
+
+
+async def sweep_sessions():
+    while True:
+        await asyncio.sleep(SESSION_SWEEP_INTERVAL)
+        await user_data.asweep()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await scenario_pool.start()
+    sweeper = asyncio.create_task(sweep_sessions())
+    prompt_log.start()
+    if journal is not None:
+        journal.start()
+    yield
+    sweeper.cancel()
+    await speculator.stop()
+    await prompt_log.stop()
+    await scenario_pool.stop()
+    await gemini.aclose()
+    if journal is not None:
+        # Last, so every change made while shutting down is on disk
+        await journal.stop()
+
+
+# Initialize FastAPI app
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware, routes=app.routes)
+
+
+async def call_gemini(prompt: str, model: str="2.0-flash", timeout: Optional[float]=None, cached_content: Optional[str]=None, response_schema: Optional[dict]=None) -> str:
+    async with scheduler.slot(model, estimate_tokens(prompt) + EXPECTED_OUTPUT_TOKENS):
+        return await gemini.generate(prompt, model=model, timeout=timeout, cached_content=cached_content, response_schema=response_schema)
+
+
+async def call_model(endpoint: str, difficulty: Optional[int], prompt: str, timeout: float, response_schema: Optional[dict]=None) -> str:
+    """Sends the prompt to the endpoint's preferred healthy model, failing over (and hedging) as configured"""
+    def call(model: str, remaining: float):
+        return call_gemini(prompt, model=model, timeout=remaining, response_schema=response_schema)
+    return await router.call(endpoint, router.models(endpoint, difficulty), call, timeout)
+
+
+def chat_model_call(prompt: str, cached_content: Optional[str], full_prompt: str, primary: str):
+    """A routed chat call: the primary model builds on its cached prefix, any other gets the full prompt"""
+    def call(model: str, remaining: float):
+        if model == primary:
+            return call_gemini(prompt, model=model, timeout=remaining, cached_content=cached_content)
+        return call_gemini(full_prompt, model=model, timeout=remaining)
+    return call
+
+
+async def generate_structured(prompt: str, output: type, schema: dict, endpoint: str, difficulty: Optional[int], timeout: float) -> Dict[str, Any]:
+    """
+    Generates JSON output matching the schema. If the response still doesn't validate,
+    asks the (cheap) chat model to repair it rather than paying for a full regeneration.
+    """
+    with metrics.stage("model_call"):
+        response = await call_model(endpoint, difficulty, prompt, timeout, response_schema=schema)
+    try:
+        with metrics.stage("parse"):
+            return parse_structured(response, output)
+    except ValueError as e:
+        repair_prompt = get_json_repair_prompt(response, str(e), json.dumps(schema))
+        with metrics.stage("repair"):
+            repaired = await call_model("repair", difficulty, repair_prompt, REPAIR_TIMEOUT, response_schema=schema)
+        with metrics.stage("parse"):
+            return parse_structured(repaired, output)
+
+
+async def generate_ground_truth(background: str, characters: List[Dict[str, str]], difficulty: Optional[int]) -> Dict[str, Any]:
+    """Generates the killer, motive, method, timeline and clues for a scenario"""
+    ground_truth_prompt = get_ground_truth_prompt(background, characters)
+    return await generate_structured(ground_truth_prompt, GroundTruth, GROUND_TRUTH_SCHEMA, "ground_truth", difficulty, GROUND_TRUTH_TIMEOUT)
+
+
+async def generate_scenario(difficulty: int, setting: str, murder_mode: str) -> Dict[str, Any]:
+    """Generates the background and characters for a new story"""
+    story_prompt = get_alternate_backstory_prompt(difficulty, setting, murder_mode)
+    return await generate_structured(story_prompt, ScenarioOutput, SCENARIO_SCHEMA, "story", difficulty, STORY_TIMEOUT)
+
+
+async def build_scenario(difficulty: int, setting: str, murder_mode: str) -> Dict[str, Any]:
+    """Generates a complete scenario: background, characters and ground truth"""
+    metrics.current_endpoint.set("background:scenario_pool")
+    classify(BACKGROUND)
+    scenario = await generate_scenario(difficulty, setting, murder_mode)
+    scenario["ground_truth"] = await generate_ground_truth(scenario["background"], scenario["characters"], difficulty)
+
+    return scenario
+
+
+scenario_pool = ScenarioPool(build_scenario, SCENARIO_POOL_TARGETS, shares=SCENARIO_POOL_SHARES)
+
+
+def build_chat_prompt(data, character_name: str, question: str, transcripts: TranscriptStore) -> Tuple[str, str]:
+    """
+    Picks the guilty or innocent prompt for the character being interrogated.
+    Returns the static prefix and the per-turn suffix separately so the prefix can be cached.
+    """
+    character = data.character(character_name)
+    conversation_history = transcripts.get(character_name).render()
+
+    if character_name == data.ground_truth["killer"]:
+        suffix = alternate_guilty_suffix(question, character, conversation_history)
     else:
-        return f"Error: {response.status_code}, {response.text}"
-    
+        suffix = alternate_innocent_suffix(question, character, conversation_history)
+    return data.chat_prefix(character_name), suffix
+
+
+def response_cache_key(session: Dict[str, Any], character_name: str) -> Optional[Tuple[str, str, str]]:
+    """(scenario, character, history state) to look answers up under, or None if the session opted out"""
+    if not RESPONSE_CACHE_ENABLED or not session.get("cache_responses", True):
+        return None
+    transcript = session["transcripts"].get(character_name).render()
+    return session["data"].scenario_id, character_name, ResponseCache.history_state(transcript)
+
+
+async def reuse_answer(user_id: int, session: Dict[str, Any], character_name: str, turn: int, question: str, cache_key: Optional[Tuple[str, str, str]]) -> Optional[str]:
+    """An answer from the response cache or from a speculation, if either has one"""
+    if cache_key:
+        answer = response_cache.lookup(*cache_key, question)
+        if answer is not None:
+            return answer
+    if session.get("speculate"):
+        with metrics.stage("speculation_wait"):
+            speculated = await speculator.take(user_id, character_name, turn, question)
+        if speculated is not None:
+            answer, seconds = speculated
+            if cache_key:
+                response_cache.store(*cache_key, question, answer, seconds)
+            return answer
+    return None
+
+
+async def answer_question(user_id: int, session: Dict[str, Any], character_name: str, question: str) -> str:
+    """Answers one interrogation question (from the caches, a speculation or the model) without recording it"""
+    with metrics.stage("prompt_build"):
+        prefix, suffix = build_chat_prompt(session["data"], character_name, question, session["transcripts"])
+        models = router.models("chat", session["difficulty"])
+        chat_prompt, cached_content = resolve_chat_prompt(user_id, character_name, prefix, suffix, models[0])
+        turn = session["transcripts"].get(character_name).turn_count
+        cache_key = response_cache_key(session, character_name)
+
+    response = await reuse_answer(user_id, session, character_name, turn, question, cache_key)
+    if response is None:
+        prompt_log.record(chat_prompt, user_id=user_id, character=character_name)
+
+        started = time.perf_counter()
+        with metrics.stage("model_call"):
+            call = chat_model_call(chat_prompt, cached_content, prefix + suffix, models[0])
+            response = await router.call("chat", models, call, CHAT_TIMEOUT)
+        if cache_key:
+            response_cache.store(*cache_key, question, response, time.perf_counter() - started)
+    return response
+
+
+def resolve_chat_prompt(user_id: int, character_name: str, prefix: str, suffix: str, model: str) -> Tuple[str, Optional[str]]:
+    """Returns the prompt to send to model and the cached content it builds on, if the prefix is cached"""
+    cached_content = context_cache.lookup(user_id, character_name, model, prefix)
+    if cached_content is not None:
+        return suffix, cached_content
+    return prefix + suffix, None
+
+
+async def summarize_conversation(character_name: str, summary: str, conversation: str, difficulty: Optional[int]) -> str:
+    summary_prompt = get_summary_prompt(character_name, summary, conversation)
+    return await call_model("summary", difficulty, summary_prompt, SUMMARY_TIMEOUT)
+
+
+# In-flight background work owned by this worker process
+summary_tasks: Dict[Tuple[int, str], asyncio.Task] = {}
+ground_truth_tasks: Dict[int, asyncio.Task] = {}
+speculation_tasks: Dict[int, asyncio.Task] = {}
+
+
+def predict_questions(history: List[Dict[str, str]], character_name: str, k: int) -> List[str]:
+    """The k likely questions the player hasn't asked this character yet"""
+    asked = {normalize_question(turn["question"]) for turn in history if turn["character"] == character_name}
+    return [question for question in LIKELY_QUESTIONS if normalize_question(question) not in asked][:k]
+
+
+async def speculative_answer(user_id: int, models: List[str], call) -> str:
+    metrics.current_endpoint.set("background:speculation")
+    classify(BACKGROUND, user_id)
+    # Nobody is waiting on a speculation yet, so it is never worth a hedged request
+    return await router.call("chat", models, call, CHAT_TIMEOUT, hedge=False)
+
+
+def speculate_answers(user_id: int, session: Dict[str, Any], character_names: List[str]):
+    """Replaces the characters' speculations with ones for the likely next questions"""
+    data = session["data"]
+    if not session.get("speculate") or data.ground_truth is None:
+        return
+
+    models = router.models("chat", session["difficulty"])
+    for character_name in character_names:
+        turn = session["transcripts"].get(character_name).turn_count
+        speculator.discard(user_id, character_name, turn)
+        for question in predict_questions(session["history"], character_name, SPECULATION_TOP_K):
+            prefix, suffix = build_chat_prompt(data, character_name, question, session["transcripts"])
+            prompt, cached_content = resolve_chat_prompt(user_id, character_name, prefix, suffix, models[0])
+            cost = estimate_tokens(prompt) + SPECULATION_ANSWER_TOKENS
+            call = functools.partial(speculative_answer, user_id, models, chat_model_call(prompt, cached_content, prefix + suffix, models[0]))
+            speculator.speculate(user_id, character_name, turn, question, cost, call)
+
+
+async def speculate_session(user_id: int):
+    """Speculates on every character's opening questions once the ground truth exists"""
+    try:
+        await wait_ground_truth(user_id)
+        session = await load_session(user_id)
+        speculate_answers(user_id, session, [character["name"] for character in session["data"].characters])
+    except Exception:
+        # Speculation is best effort; the real request will generate what it needs
+        pass
+
+
+def start_speculation(user_id: int):
+    task = asyncio.create_task(speculate_session(user_id))
+    speculation_tasks[user_id] = task
+    task.add_done_callback(lambda task: speculation_tasks.pop(user_id, None) if speculation_tasks.get(user_id) is task else None)
+
+
+async def summarize_transcript(user_id: int, character_name: str, offset: int, count: int, conversation: str, summary: str):
+    """Folds the oldest turns of a transcript into its running summary"""
+    metrics.current_endpoint.set("background:summary")
+    classify(BACKGROUND, user_id)
+    try:
+        try:
+            difficulty = (await load_session(user_id))["difficulty"]
+            new_summary = await summarize_conversation(character_name, summary, conversation, difficulty)
+        except Exception:
+            # Never let the transcript grow without bound when summarization fails
+            await user_data.aupdate(user_id, lambda session: session["transcripts"].get(character_name).truncate())
+            journal_event(user_id, {"op": "truncate", "character": character_name})
+            return
+        if await user_data.aupdate(user_id, lambda session: session["transcripts"].get(character_name).apply_summary(offset, count, new_summary)):
+            journal_event(user_id, {"op": "summary", "character": character_name, "offset": offset, "count": count, "summary": new_summary})
+    except KeyError:
+        # The session expired in the meantime
+        pass
+
+
+def start_summary(user_id: int, character_name: str, pending: Tuple[int, int, str, str]):
+    key = (user_id, character_name)
+    if key in summary_tasks and not summary_tasks[key].done():
+        return
+    task = asyncio.create_task(summarize_transcript(user_id, character_name, *pending))
+    summary_tasks[key] = task
+    task.add_done_callback(lambda task: summary_tasks.pop(key, None) if summary_tasks.get(key) is task else None)
+
+
+def append_turns(session: Dict[str, Any], turns: List[Tuple[str, str, str]]):
+    for character_name, question, answer in turns:
+        session["history"].append({"character": character_name, "question": question, "answer": answer})
+        session["transcripts"].get(character_name).append(question, answer)
+    del session["history"][:-HISTORY_LIMIT]
+
+
+async def record_turns(user_id: int, turns: List[Tuple[str, str, str]]):
+    """
+    Appends (character, question, answer) turns to the game history and to the characters'
+    transcripts in a single session update, in the given order.
+    """
+    def append(session):
+        pending = {}
+        append_turns(session, turns)
+        for character_name in characters:
+            transcript = session["transcripts"].get(character_name)
+            if transcript.over_budget():
+                pending[character_name] = transcript.pending_summary() + (transcript.summary,)
+        return pending, session
+
+    characters = list(dict.fromkeys(character_name for character_name, _, _ in turns))
+    pending, session = await user_data.aupdate(user_id, append)
+    journal_event(user_id, {"op": "turns", "turns": [list(turn) for turn in turns]})
+    for character_name, summary in pending.items():
+        start_summary(user_id, character_name, summary)
+    if session.get("speculate"):
+        # The history moved on: speculations for the previous turn are useless now
+        speculate_answers(user_id, session, characters)
+
+
+async def record_turn(user_id: int, character_name: str, question: str, answer: str):
+    """Appends a turn to the game history and to the character's transcript"""
+    await record_turns(user_id, [(character_name, question, answer)])
+
+
+async def start_ground_truth(user_id: int):
+    """Kicks off ground truth generation in the background (at most one in flight per session)"""
+    task = ground_truth_tasks.get(user_id)
+    if task is not None and not task.done():
+        return
+
+    def claim(session):
+        started = session.get("ground_truth_started")
+        if session["data"].ground_truth is not None:
+            return None
+        # Another worker owns the generation unless it has clearly given up
+        if started is not None and time.time() - started < GROUND_TRUTH_TIMEOUT + 30:
+            return None
+        session["ground_truth_started"] = time.time()
+        return session
+
+    session = await user_data.aupdate(user_id, claim)
+    if session is None:
+        return
+
+    data = session["data"]
+    task = asyncio.create_task(generate_session_ground_truth(user_id, data.background, data.characters, session["difficulty"]))
+    ground_truth_tasks[user_id] = task
+
+    def done(task):
+        if ground_truth_tasks.get(user_id) is task:
+            ground_truth_tasks.pop(user_id)
+        # Failures are reported to whoever awaits the task; don't log them as unretrieved
+        task.cancelled() or task.exception()
+
+    task.add_done_callback(done)
+
+
+async def generate_session_ground_truth(user_id: int, background: str, characters: List[Dict[str, str]], difficulty: Optional[int]) -> Dict[str, Any]:
+    def release(session):
+        session["ground_truth_started"] = None
+
+    def store(session):
+        session["data"].set_ground_truth(ground_truth)
+        session["ground_truth_started"] = None
+
+    metrics.current_endpoint.set("background:ground_truth")
+    classify(GROUND_TRUTH, user_id)
+    try:
+        ground_truth = await generate_ground_truth(background, characters, difficulty)
+    except BaseException:
+        # Let the next caller try again
+        await user_data.aupdate(user_id, release)
+        raise
+    await user_data.aupdate(user_id, store)
+    journal_event(user_id, {"op": "ground_truth", "ground_truth": ground_truth})
+    return ground_truth
+
+
+async def load_session(user_id: int) -> Dict[str, Any]:
+    session = await user_data.aget(user_id)
+    if session is None:
+        raise KeyError(user_id)
+    return session
+
 
-def parse_llm_into_scenario(llm_response):
-    response_alt = llm_response.replace("\n", "")
-    response_alt = response_alt.replace("```json", '"')
-    response_alt = response_alt.replace("```", "")
-    response_alt = response_alt[1:]
-    questions = json.loads(response_alt)
+async def wait_ground_truth(user_id: int, session: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Returns the session's ground truth, awaiting the shared in-flight generation if needed.
+    A failed generation is restarted by the next caller. session saves the first lookup
+    if the caller already has it.
+    """
+    while True:
+        data = (session or await load_session(user_id))["data"]
+        session = None
+        if data.ground_truth is not None:
+            return data.ground_truth
 
-    return questions
+        await start_ground_truth(user_id)
+        task = ground_truth_tasks.get(user_id)
+        if task is not None:
+            # Shielded so a caller that goes away does not cancel generation for everyone else
+            return await asyncio.shield(task)
+
+        # Another worker is generating it: wait for it to show up in the shared store
+        await asyncio.sleep(GROUND_TRUTH_POLL_INTERVAL)
+
+
+async def ready_session(user_id: int, session: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    The session with its ground truth in place. Each store lookup may decode the whole
+    session (SQLite), so requests fetch it once and pass it down; it is only fetched again
+    if the ground truth had to be waited for.
+    """
+    if session["data"].ground_truth is None:
+        await wait_ground_truth(user_id, session)
+        session = await load_session(user_id)
+    return session
+
+
+def overloaded(e: SchedulerBusy) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+def sse_event(data: dict, event: Optional[str] = None) -> str:
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
 
 # ---- Request Models ----
 class StoryRequest(BaseModel):
     difficulty: int
     setting: str  # "supermarket", "movie theater", "swimming pool", etc
     murder_mode: str    # "poison", "stabbing", "shooting", etc
+    cache_responses: bool = True    # reuse answers to questions other players already asked
+    speculate: bool = False         # pre-generate answers to the likely next questions
 
 class Characters(BaseModel):
     name: str
@@ -88,11 +589,25 @@ class GroundTruth(BaseModel):
     timeline: List[str]
     clues: Any
 
+# JSON output requested from the model, derived from the response models above
+ScenarioOutput = output_model(StoryResponse, exclude={"user_id"})
+SCENARIO_SCHEMA = gemini_schema(ScenarioOutput)
+GROUND_TRUTH_SCHEMA = gemini_schema(GroundTruth, overrides={"clues": {"type": "array", "items": {"type": "string"}}})
+
 class ConversationRequest(BaseModel):
     user_id: int
     character: str
     question: str
 
+class BatchConversationRequest(BaseModel):
+    user_id: int
+    characters: List[str]   # answered concurrently, recorded in this order
+    question: str
+
+class BatchAnswer(BaseModel):
+    character: str
+    answer: str
+
 class StoryDetails():
     background: str
     characters: List[Dict[str, str]]
@@ -101,56 +616,180 @@ class StoryDetails():
     def __init__(self, background):
         self.background = background['background']
         self.characters = background['characters']
+        self.ground_truth = background.get('ground_truth')
+        self._characters_by_name = {character['name']: character for character in self.characters}
+        self._reset_prompt_cache()
     
     def set_ground_truth(self, ground_truth):
         self.ground_truth = ground_truth
+        self._reset_prompt_cache()
+
+    def _reset_prompt_cache(self):
+        # Everything below is derived from the ground truth, so it is rebuilt when that changes
+        self._scenario_id = None
+        self._fragments = None
+        self._prefixes: Dict[str, str] = {}
+
+    @property
+    def scenario_id(self) -> str:
+        """Content hash of the scenario, so identical (e.g. pooled) scenarios share an id"""
+        if self._scenario_id is None:
+            content = json.dumps([self.background, self.characters, self.ground_truth], sort_keys=True)
+            self._scenario_id = hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+        return self._scenario_id
+
+    def character(self, name: str) -> Dict[str, str]:
+        return self._characters_by_name[name]
+
+    def chat_prefix(self, character_name: str) -> str:
+        """The static part of a character's interrogation prompt, rendered once per session"""
+        prefix = self._prefixes.get(character_name)
+        if prefix is None:
+            if self._fragments is None:
+                self._fragments = scenario_fragments(self.to_dict(), self.ground_truth)
+            render = alternate_guilty_prefix if character_name == self.ground_truth['killer'] else alternate_innocent_prefix
+            prefix = render(self.character(character_name), self.to_dict(), self.ground_truth, self._fragments)
+            self._prefixes[character_name] = prefix
+        return prefix
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"background": self.background, "characters": self.characters, "ground_truth": self.ground_truth}
     
 
+def encode_session(session: Dict[str, Any]) -> Dict[str, Any]:
+    encoded = dict(session)
+    encoded["data"] = session["data"].to_dict()
+    encoded["transcripts"] = session["transcripts"].to_dict()
+    return encoded
+
+
+def decode_session(encoded: Dict[str, Any]) -> Dict[str, Any]:
+    session = dict(encoded)
+    session["data"] = StoryDetails(encoded["data"])
+    session["transcripts"] = TranscriptStore.from_dict(encoded["transcripts"])
+    return session
+
+
+def estimate_session_bytes(session: Dict[str, Any]) -> int:
+    """Approximate footprint of a session: background, characters, ground truth, transcripts and history"""
+    return len(json.dumps(encode_session(session), separators=(",", ":")))
+
+
+def on_session_evicted(user_id: int):
+    # The session's prompt caches would otherwise live on until their TTL runs out
+    speculator.drop_session(user_id)
+    try:
+        asyncio.get_running_loop().create_task(context_cache.drop_session(user_id))
+    except RuntimeError:
+        pass
+
+
+def apply_session_event(session: Optional[Dict[str, Any]], event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Replays one journaled change; mirrors what the handlers did to the live session"""
+    op = event["op"]
+    if op == "create":
+        return decode_session(event["session"])
+    if session is None:
+        # Tail of a session whose snapshot has expired
+        return None
+    if op == "ground_truth":
+        session["data"].set_ground_truth(event["ground_truth"])
+    elif op == "turns":
+        append_turns(session, [tuple(turn) for turn in event["turns"]])
+    elif op == "summary":
+        session["transcripts"].get(event["character"]).apply_summary(event["offset"], event["count"], event["summary"])
+    elif op == "truncate":
+        session["transcripts"].get(event["character"]).truncate()
+    return session
+
+
+def journal_event(user_id: int, event: Dict[str, Any]):
+    if journal is not None:
+        journal.record(user_id, event)
+
+
+journal: Optional[SessionJournal] = None
+if SESSION_DB:
+    user_data: SessionStore = SQLiteSessionStore(SESSION_DB, encode_session, decode_session, idle_ttl=SESSION_IDLE_TTL)
+else:
+    if JOURNAL_DIR:
+        journal = SessionJournal(
+            JOURNAL_DIR,
+            apply_session_event,
+            encode_session,
+            compact_bytes=JOURNAL_COMPACT_BYTES,
+            retention=JOURNAL_RETENTION,
+        )
+    user_data: SessionStore = InMemorySessionStore(
+        max_sessions=MAX_SESSIONS,
+        idle_ttl=SESSION_IDLE_TTL,
+        spill_dir=SESSION_SPILL_DIR,
+        encode=encode_session,
+        decode=decode_session,
+        sizeof=estimate_session_bytes,
+        on_evict=on_session_evicted,
+        # Sessions from before a restart are rebuilt from the journal on first access
+        loader=journal.load if journal is not None else None,
+        first_id=journal.max_id + 1 if journal is not None else 1,
+    )
+
+
 # ---- Endpoints ----
 
 @app.post("/story/generate")
-def generate_story(request: StoryRequest) -> StoryResponse:
+async def generate_story(request: StoryRequest) -> StoryResponse:
     """Generates a story using Gemini 2.0 Flash"""
-    
-    num_users = len(user_data) + 1
-    user_data[num_users] = {"difficulty": request.difficulty, "setting": request.setting, "mode": request.murder_mode}
+    classify(STORY)
 
-    user_data[num_users]["history"] = []
-    
     try:
-        story_prompt = get_alternate_backstory_prompt(request.difficulty, request.setting, request.murder_mode)
-        response = call_gemini(story_prompt)
-        response = parse_llm_into_scenario(response)
+        with metrics.stage("pool_take"):
+            response = scenario_pool.take(request.difficulty, request.setting, request.murder_mode)
+        if response is None:
+            response = await generate_scenario(request.difficulty, request.setting, request.murder_mode)
 
-        user_data[num_users]["data"] = StoryDetails(response)
+        session = {
+            "difficulty": request.difficulty,
+            "setting": request.setting,
+            "mode": request.murder_mode,
+            "history": [],
+            "transcripts": TranscriptStore(TRANSCRIPT_TOKEN_BUDGET, TRANSCRIPT_KEEP_RECENT),
+            "data": StoryDetails(response),
+            "ground_truth_started": None,
+            "cache_responses": request.cache_responses,
+            "speculate": request.speculate,
+        }
+        user_id = await user_data.acreate(session)
+        journal_event(user_id, {"op": "create", "session": encode_session(session)})
+        # Generate the ground truth (if the scenario didn't come with one) while the player reads the background
+        await start_ground_truth(user_id)
+        if request.speculate:
+            start_speculation(user_id)
         return {
-            "user_id": num_users,
+            "user_id": user_id,
             "background": response["background"], 
             "characters": response["characters"]
         }
     
+    except SchedulerBusy as e:
+        raise overloaded(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/story/ground_truth")
-def get_ground_truth(user_id: int) -> GroundTruth:
-    """Generates the ground truth of the story: the killer, the motive, the method, the clues and the timeline"""
+async def get_ground_truth(user_id: int) -> GroundTruth:
+    """Returns the ground truth of the story: the killer, the motive, the method, the clues and the timeline"""
 
-    if user_id not in user_data:
+    session = await user_data.aget(user_id)
+    if session is None:
         raise HTTPException(status_code=404, detail="User not found")
+    classify(GROUND_TRUTH, user_id)
     
-    data = user_data[user_id]["data"]
-
     try:
-        ground_truth_prompt = get_ground_truth_prompt(data.background, data.characters)
-        ground_truth = call_gemini(ground_truth_prompt, model="2.5-flash-preview-04-17")
-        ground_truth = parse_llm_into_scenario(ground_truth)
-
-        user_data[user_id]["data"].set_ground_truth(ground_truth)
-
-        return ground_truth
+        return await wait_ground_truth(user_id, session)
     
+    except SchedulerBusy as e:
+        raise overloaded(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -158,32 +797,256 @@ def get_ground_truth(user_id: int) -> GroundTruth:
 async def chat(request: ConversationRequest) -> str:
     """Simulates the conversation"""
     user_id = request.user_id
-    if user_id not in user_data:
+    session = await user_data.aget(user_id)
+    if session is None:
         raise HTTPException(status_code=404, detail="User not found")
     
-    data = user_data[user_id]["data"]
-    
     character_name = request.character
     question = request.question
+    classify(CHAT, user_id)
+
+    try:
+        with metrics.stage("ground_truth_wait"):
+            session = await ready_session(user_id, session)
+        response = await answer_question(user_id, session, character_name, question)
+        with metrics.stage("history_update"):
+            await record_turn(user_id, character_name, question, response)
     
-    history = user_data[user_id]["history"]
-    character = [ch for ch in data.characters if ch["name"] == character_name]
-    background = {"background": data.background, "characters": data.characters}
+        return response
+    except SchedulerBusy as e:
+        raise overloaded(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/conversation/stream")
+async def chat_stream(request: ConversationRequest, http_request: Request) -> StreamingResponse:
+    """Simulates the conversation, streaming the answer as Server-Sent Events"""
+    user_id = request.user_id
+    session = await user_data.aget(user_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    character_name = request.character
+    question = request.question
+    classify(CHAT, user_id)
 
     try:
-        if character_name == data.ground_truth["killer"]:
-            chat_prompt = alternate_guilty_prompt(question, character[0], background, data.ground_truth, history)
-        else:
-            chat_prompt = alternate_innocent_prompt(question, character[0], background, data.ground_truth, history)
+        with metrics.stage("ground_truth_wait"):
+            session = await ready_session(user_id, session)
+        with metrics.stage("prompt_build"):
+            prefix, suffix = build_chat_prompt(session["data"], character_name, question, session["transcripts"])
+            models = router.models("chat", session["difficulty"])
+            chat_prompt, cached_content = resolve_chat_prompt(user_id, character_name, prefix, suffix, models[0])
+            turn = session["transcripts"].get(character_name).turn_count
+            cache_key = response_cache_key(session, character_name)
+        cached_response = await reuse_answer(user_id, session, character_name, turn, question, cache_key)
+        if cached_response is None:
+            # Turn the player away now; once the stream has started it's too late for a 429
+            scheduler.admit()
+    except SchedulerBusy as e:
+        raise overloaded(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        print(chat_prompt)
+    if cached_response is None:
+        prompt_log.record(chat_prompt, user_id=user_id, character=character_name)
 
-        response = call_gemini(chat_prompt)
-        history.append({"character": character_name, "question": question, "answer": response})
-    
-        return response
+    async def open_stream(model: str, remaining: float):
+        # Only the primary model has the prefix cached; a fallback gets the full prompt
+        prompt, cached = (chat_prompt, cached_content) if model == models[0] else (prefix + suffix, None)
+        async with scheduler.slot(model, estimate_tokens(prompt) + EXPECTED_OUTPUT_TOKENS):
+            async for chunk in gemini.stream(prompt, model=model, timeout=remaining, cached_content=cached):
+                yield chunk
+
+    async def event_stream():
+        if cached_response is not None:
+            await record_turn(user_id, character_name, question, cached_response)
+            yield sse_event({"text": cached_response})
+            yield sse_event({"answer": cached_response}, event="done")
+            return
+
+        chunks = []
+        started = time.perf_counter()
+        try:
+            async for chunk in router.stream("chat", models, open_stream, CHAT_TIMEOUT):
+                if await http_request.is_disconnected():
+                    # Player left mid-answer: drop the partial reply
+                    return
+                if not chunks:
+                    metrics.stage_seconds.observe(time.perf_counter() - started, endpoint=metrics.current_endpoint.get(), stage="first_token")
+                chunks.append(chunk)
+                yield sse_event({"text": chunk})
+        except (GeminiError, SchedulerBusy) as e:
+            yield sse_event({"detail": str(e)}, event="error")
+            return
+
+        response = "".join(chunks)
+        if cache_key:
+            response_cache.store(*cache_key, question, response, time.perf_counter() - started)
+        with metrics.stage("history_update"):
+            await record_turn(user_id, character_name, question, response)
+        yield sse_event({"answer": response}, event="done")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/conversation/batch")
+async def chat_batch(request: BatchConversationRequest) -> List[BatchAnswer]:
+    """Puts the same question to several characters at once; the answers are generated concurrently"""
+    user_id = request.user_id
+    session = await user_data.aget(user_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    characters = list(dict.fromkeys(request.characters))
+    question = request.question
+    classify(CHAT, user_id)
+
+    tasks = []
+    try:
+        with metrics.stage("ground_truth_wait"):
+            session = await ready_session(user_id, session)
+        tasks = [asyncio.create_task(answer_question(user_id, session, name, question)) for name in characters]
+        answers = await asyncio.gather(*tasks)
+        with metrics.stage("history_update"):
+            await record_turns(user_id, [(name, question, answer) for name, answer in zip(characters, answers)])
+
+        return [{"character": name, "answer": answer} for name, answer in zip(characters, answers)]
+    except SchedulerBusy as e:
+        raise overloaded(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+@app.post("/conversation/batch/stream")
+async def chat_batch_stream(request: BatchConversationRequest, http_request: Request) -> StreamingResponse:
+    """
+    Puts the same question to several characters at once, streaming each answer as an
+    "answer" event as soon as it is ready. The turns are recorded together, in request
+    order, once every character has answered.
+    """
+    user_id = request.user_id
+    session = await user_data.aget(user_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    characters = list(dict.fromkeys(request.characters))
+    question = request.question
+    classify(CHAT, user_id)
+
+    try:
+        with metrics.stage("ground_truth_wait"):
+            session = await ready_session(user_id, session)
+        scheduler.admit()
+    except SchedulerBusy as e:
+        raise overloaded(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def event_stream():
+        tasks = {asyncio.create_task(answer_question(user_id, session, name, question)): name for name in characters}
+        pending = set(tasks)
+        answers = {}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                if await http_request.is_disconnected():
+                    # Detective left: don't record a partial set of answers
+                    return
+                for task in done:
+                    answers[tasks[task]] = task.result()
+                    yield sse_event({"character": tasks[task], "answer": answers[tasks[task]]}, event="answer")
+        except Exception as e:
+            yield sse_event({"detail": str(e)}, event="error")
+            return
+        finally:
+            for task in pending:
+                task.cancel()
+
+        turns = [(name, question, answers[name]) for name in characters]
+        with metrics.stage("history_update"):
+            await record_turns(user_id, turns)
+        yield sse_event({"answers": [{"character": name, "answer": answer} for name, _, answer in turns]}, event="done")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/metrics")
+def get_metrics() -> PlainTextResponse:
+    """Prometheus-style metrics: per-stage timings, model tokens and bytes, in-flight requests"""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
+metrics.registry.add_collector(
+    "murder_sessions", "Session store", lambda: user_data.stats(),
+    counters=("evicted", "expired", "spilled", "reloaded", "restored"),
+)
+metrics.registry.add_collector(
+    "murder_scenario_pool", "Scenario pool", lambda: scenario_pool.stats(),
+    counters=("hits", "misses", "expired", "refills", "refill_failures"),
+)
+metrics.registry.add_collector(
+    "murder_context_cache", "Gemini context cache", lambda: context_cache.stats(),
+    counters=("hits", "misses", "failures"),
+)
+metrics.registry.add_collector(
+    "murder_response_cache", "Response cache", lambda: response_cache.stats(),
+    counters=("exact_hits", "semantic_hits", "misses", "saved_seconds"),
+)
+metrics.registry.add_collector(
+    "murder_speculation", "Speculative answers", lambda: speculator.stats(),
+    counters=("launched", "hits", "misses", "discarded", "abandoned", "over_budget", "tokens_spent", "saved_seconds"),
+)
+metrics.registry.add_collector(
+    "murder_scheduler", "Model call scheduler", lambda: scheduler.stats(),
+    counters=["rate_limited"] + [f"{kind}_{name}" for kind in ("granted", "rejected") for name in PRIORITY_NAMES],
+)
+metrics.registry.add_collector(
+    "murder_router", "Model router", lambda: router.stats(),
+    counters=("calls", "rerouted", "failovers", "hedged", "hedge_wins"),
+)
+if journal is not None:
+    metrics.registry.add_collector(
+        "murder_journal", "Session journal", lambda: journal.stats(),
+        counters=("fsyncs", "compactions", "replayed", "dropped"),
+    )
+metrics.registry.add_collector("murder_prompt_log", "Prompt log", lambda: {"dropped": prompt_log.dropped}, counters=("dropped",))
+
+
+@app.get("/sessions/stats")
+def get_session_stats() -> Dict[str, Any]:
+    """Live session count, per-session byte estimates and eviction counters"""
+    return user_data.stats()
+
+
+@app.get("/conversation/cache")
+def get_response_cache_stats() -> Dict[str, Any]:
+    """Response cache hit ratio and model time saved"""
+    return response_cache.stats()
+
+
+@app.get("/models/stats")
+def get_model_stats() -> Dict[str, Any]:
+    """Failovers, hedges and rolling per-model latency and error rates by endpoint"""
+    return router.stats()
+
+
+@app.get("/story/pool")
+def get_pool_stats() -> Dict[str, Any]:
+    """Scenario pool hit rate, refill lag and per-key depth"""
+    return scenario_pool.stats()
 
 
 # # ---- Run the Server ----
@@ -0,0 +1,190 @@
+"""
+Local stand-in for the Gemini (generativelanguage) REST API, for load tests and benchmarks.
+
+Serves generateContent, streamGenerateContent (SSE) and cachedContents with canned
+scenario / ground truth / interrogation replies, a configurable latency distribution,
+token rate and error rate. No API key or quota needed.
+
+    python benchmarks/fake_gemini.py --port 9000 --latency-median 0.8 --error-rate 0.02
+    GEMINI_API_ROOT=http://127.0.0.1:9000 uvicorn backend:app
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+from dataclasses import dataclass
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+
+@dataclass
+class FakeGeminiConfig:
+    latency_median: float = 0.8     # seconds until the first token (lognormal median)
+    latency_sigma: float = 0.4      # lognormal shape; larger means a heavier tail
+    tokens_per_second: float = 100.0
+    error_rate: float = 0.0         # fraction of requests answered with a 503
+    rate_limit_rate: float = 0.0    # fraction of requests answered with a 429
+    chunk_tokens: int = 8           # tokens per streamed chunk
+
+
+SCENARIO = {
+    "background": (
+        "At 9:40 PM the night manager of the Riverside Supermarket, Alan Pierce, was found slumped "
+        "behind the bakery counter. A half-eaten almond croissant lay beside him and the air smelled "
+        "faintly of bitter almonds and floor polish. The delivery door was propped open with a crate "
+        "of lemons, and the security camera over aisle 7 had been turned to face the wall."
+    ),
+    "characters": [
+        {"name": "Maria Lopez", "description": "42, head baker. Argued with Alan about her hours last week. Says she left at 9 PM."},
+        {"name": "Tom Becker", "description": "29, stock clerk. Owes Alan money. Was restocking the cleaning aisle all evening."},
+        {"name": "Grace Holt", "description": "55, regional auditor. Arrived unannounced to review the store's accounts."},
+    ],
+}
+
+GROUND_TRUTH = {
+    "killer": "Tom Becker",
+    "method": "Cyanide-based rodent poison mixed into the croissant glaze",
+    "motive": "Alan was about to report Tom's theft from the till",
+    "timeline": [
+        "8:45 PM - Tom takes rodent poison from the stock room.",
+        "9:10 PM - Tom glazes the croissant while Maria is in the cold room.",
+        "9:30 PM - Alan eats the croissant.",
+        "9:40 PM - Grace finds the body.",
+    ],
+    "clues": [
+        "Tom mentions the croissant before anyone told him about it.",
+        "Tom claims he never entered the bakery, but Maria saw flour on his sleeves.",
+        "Tom knows the camera in aisle 7 was turned around.",
+    ],
+}
+
+ANSWER = (
+    "I already told the other officer, I was in the cleaning aisle the whole evening. "
+    "Alan and I had our differences, sure, but nobody wanted him dead. You should ask Maria "
+    "why she was still in the bakery after nine, if you ask me."
+)
+
+SUMMARY = "The suspect claims to have been in the cleaning aisle all evening and points at Maria."
+
+
+def fake_reply(prompt: str) -> str:
+    if "could not be used" in prompt:
+        return json.dumps(GROUND_TRUTH if '"killer"' in prompt else SCENARIO)
+    if "identify the likely suspect" in prompt:
+        return json.dumps(GROUND_TRUTH)
+    if "mystery scenario generator" in prompt:
+        return json.dumps(SCENARIO)
+    if "keeping notes" in prompt:
+        return SUMMARY
+    return ANSWER
+
+
+def count_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def create_app(config: FakeGeminiConfig) -> FastAPI:
+    app = FastAPI()
+    cache_ids = itertools.count(1)
+    caches = {}
+
+    def first_token_delay() -> float:
+        return random.lognormvariate(0, config.latency_sigma) * config.latency_median
+
+    def injected_error():
+        roll = random.random()
+        if roll < config.rate_limit_rate:
+            return JSONResponse({"error": {"code": 429, "message": "Resource exhausted"}}, status_code=429, headers={"Retry-After": "1"})
+        if roll < config.rate_limit_rate + config.error_rate:
+            return JSONResponse({"error": {"code": 503, "message": "The model is overloaded"}}, status_code=503)
+        return None
+
+    def request_prompt(body: dict) -> str:
+        texts = [part.get("text", "") for content in body.get("contents", []) for part in content.get("parts", [])]
+        cached = caches.get(body.get("cachedContent"), "")
+        return cached + "".join(texts)
+
+    def usage(prompt: str, reply: str) -> dict:
+        return {"promptTokenCount": count_tokens(prompt), "candidatesTokenCount": count_tokens(reply)}
+
+    def candidate(text: str) -> dict:
+        return {"content": {"role": "model", "parts": [{"text": text}]}}
+
+    @app.post("/v1beta/models/{target}")
+    async def models(target: str, request: Request):
+        model, _, method = target.partition(":")
+        body = await request.json()
+        prompt = request_prompt(body)
+        reply = fake_reply(prompt)
+
+        error = injected_error()
+        if error is not None:
+            await asyncio.sleep(first_token_delay() / 4)
+            return error
+
+        if method == "streamGenerateContent":
+            async def events():
+                await asyncio.sleep(first_token_delay())
+                words = reply.split(" ")
+                step = max(1, config.chunk_tokens * 3 // 4)   # ~0.75 words per token
+                for i in range(0, len(words), step):
+                    chunk = " ".join(words[i:i + step]) + (" " if i + step < len(words) else "")
+                    data = {"candidates": [candidate(chunk)], "usageMetadata": usage(prompt, reply), "modelVersion": model}
+                    yield f"data: {json.dumps(data)}\r\n\r\n"
+                    await asyncio.sleep(config.chunk_tokens / config.tokens_per_second)
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        await asyncio.sleep(first_token_delay() + count_tokens(reply) / config.tokens_per_second)
+        return {"candidates": [candidate(reply)], "usageMetadata": usage(prompt, reply), "modelVersion": model}
+
+    @app.post("/v1beta/cachedContents")
+    async def create_cache(request: Request):
+        body = await request.json()
+        name = f"cachedContents/fake-{next(cache_ids)}"
+        instruction = body.get("systemInstruction") or body.get("system_instruction") or {}
+        caches[name] = "".join(part.get("text", "") for part in instruction.get("parts", []))
+        return {"name": name, "model": body.get("model"), "usageMetadata": {"totalTokenCount": count_tokens(caches[name])}}
+
+    @app.patch("/v1beta/cachedContents/{cache_id}")
+    async def update_cache(cache_id: str):
+        return {"name": f"cachedContents/{cache_id}"}
+
+    @app.delete("/v1beta/cachedContents/{cache_id}")
+    async def delete_cache(cache_id: str):
+        caches.pop(f"cachedContents/{cache_id}", None)
+        return Response(content="{}", media_type="application/json")
+
+    return app
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    defaults = FakeGeminiConfig()
+    parser.add_argument("--latency-median", type=float, default=defaults.latency_median)
+    parser.add_argument("--latency-sigma", type=float, default=defaults.latency_sigma)
+    parser.add_argument("--tokens-per-second", type=float, default=defaults.tokens_per_second)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--rate-limit-rate", type=float, default=defaults.rate_limit_rate)
+
+
+def config_from_args(args: argparse.Namespace) -> FakeGeminiConfig:
+    return FakeGeminiConfig(
+        latency_median=args.latency_median,
+        latency_sigma=args.latency_sigma,
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+    )
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    add_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(config_from_args(args)), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,235 @@
+"""
+Load test and latency benchmark for the game API, against a local fake Gemini server.
+
+Starts benchmarks/fake_gemini.py and the FastAPI app (each on its own thread and event
+loop), then drives the app with concurrent simulated detectives: each one generates a
+story, fetches the ground truth and interrogates the suspects, mixing /conversation and
+/conversation/stream. Reports requests/sec, p50/p95/p99 latency per endpoint, streaming
+time-to-first-token and how long the app's event loop was blocked, as JSON.
+
+    python benchmarks/loadtest.py --detectives 50 --questions 8 --output bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import httpx
+import uvicorn
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_gemini import add_arguments, config_from_args, create_app
+
+SETTINGS = ["supermarket", "movie theater", "swimming pool", "museum", "train"]
+MURDER_MODES = ["poison", "stabbing", "shooting"]
+QUESTIONS = [
+    "Where were you at the time of the murder?",
+    "How did you know the victim?",
+    "What did you see tonight?",
+    "Did anyone have a reason to hurt the victim?",
+    "Why were you still here after closing?",
+]
+
+# The monitor task wakes up every LAG_INTERVAL; anything later than that is time the loop was blocked
+LAG_INTERVAL = 0.005
+LAG_THRESHOLD = 0.010
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class ServerThread:
+    """Runs an ASGI app with uvicorn on its own thread and event loop"""
+
+    def __init__(self, app, port: int, monitor_lag: bool = False):
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        self.monitor_lag = monitor_lag
+        self.lags: List[float] = []
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        if self.monitor_lag:
+            loop.create_task(self._monitor())
+        loop.run_until_complete(self.server.serve())
+
+    async def _monitor(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(LAG_INTERVAL)
+            self.lags.append(max(0.0, loop.time() - start - LAG_INTERVAL))
+
+    def start(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else 0.0,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values, default=0.0),
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.ttft: List[float] = []
+
+    def record(self, endpoint: str, started: float, status: int):
+        if status == 200:
+            self.latencies[endpoint].append(time.perf_counter() - started)
+        else:
+            self.errors[endpoint][str(status)] += 1
+
+
+async def detective(client: httpx.AsyncClient, recorder: Recorder, args: argparse.Namespace):
+    started = time.perf_counter()
+    response = await client.post("/story/generate", json={
+        "difficulty": random.randint(1, 10),
+        "setting": random.choice(SETTINGS),
+        "murder_mode": random.choice(MURDER_MODES),
+        # The fake answers every game identically, so cached answers would hide the real request path
+        "cache_responses": args.response_cache,
+    })
+    recorder.record("/story/generate", started, response.status_code)
+    if response.status_code != 200:
+        return
+    story = response.json()
+    user_id = story["user_id"]
+
+    started = time.perf_counter()
+    response = await client.get("/story/ground_truth", params={"user_id": user_id})
+    recorder.record("/story/ground_truth", started, response.status_code)
+
+    for _ in range(args.questions):
+        await asyncio.sleep(random.uniform(0, args.think_time))
+        body = {
+            "user_id": user_id,
+            "character": random.choice(story["characters"])["name"],
+            "question": random.choice(QUESTIONS),
+        }
+        started = time.perf_counter()
+        if random.random() < args.stream_ratio:
+            async with client.stream("POST", "/conversation/stream", json=body) as response:
+                first_token = None
+                async for line in response.aiter_lines():
+                    if first_token is None and line.startswith("data:"):
+                        first_token = time.perf_counter() - started
+                if response.status_code == 200 and first_token is not None:
+                    recorder.ttft.append(first_token)
+            recorder.record("/conversation/stream", started, response.status_code)
+        else:
+            response = await client.post("/conversation", json=body)
+            recorder.record("/conversation", started, response.status_code)
+
+
+async def run_load(base_url: str, args: argparse.Namespace) -> Recorder:
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.detectives, max_keepalive_connections=args.detectives)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        semaphore = asyncio.Semaphore(args.detectives)
+
+        async def bounded():
+            async with semaphore:
+                await detective(client, recorder, args)
+
+        await asyncio.gather(*(bounded() for _ in range(args.games or args.detectives)))
+    return recorder
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--detectives", type=int, default=20, help="concurrent simulated players")
+    parser.add_argument("--games", type=int, default=0, help="total games to play (default: one per detective)")
+    parser.add_argument("--questions", type=int, default=5, help="questions per game")
+    parser.add_argument("--stream-ratio", type=float, default=0.5, help="fraction of questions sent to /conversation/stream")
+    parser.add_argument("--think-time", type=float, default=0.0, help="max random pause between questions (seconds)")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--pool", action="store_true", help="keep the scenario pool enabled")
+    parser.add_argument("--response-cache", action="store_true", help="let games use the response cache (off: every question reaches the model)")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    fake = ServerThread(create_app(config_from_args(args)), free_port())
+    fake.start()
+    os.environ["GEMINI_API_ROOT"] = f"http://127.0.0.1:{fake.server.config.port}"
+
+    import backend
+    if not args.pool:
+        backend.scenario_pool.targets.clear()
+
+    app = ServerThread(backend.app, free_port(), monitor_lag=True)
+    app.start()
+
+    started = time.perf_counter()
+    recorder = asyncio.run(run_load(f"http://127.0.0.1:{app.server.config.port}", args))
+    elapsed = time.perf_counter() - started
+
+    app.stop()
+    fake.stop()
+
+    requests = sum(len(values) for values in recorder.latencies.values())
+    errors = sum(sum(codes.values()) for codes in recorder.errors.values())
+    lags = app.lags
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "elapsed_seconds": elapsed,
+        "requests": requests,
+        "errors": errors,
+        "requests_per_second": requests / elapsed if elapsed else 0.0,
+        "endpoints": {
+            endpoint: {**summarize(values), "errors": dict(recorder.errors.get(endpoint, {}))}
+            for endpoint, values in sorted(recorder.latencies.items())
+        },
+        "time_to_first_token": summarize(recorder.ttft),
+        "event_loop": {
+            "samples": len(lags),
+            "lag_p99": percentile(lags, 99),
+            "lag_max": max(lags, default=0.0),
+            "blocked_seconds": sum(lag for lag in lags if lag > LAG_THRESHOLD),
+        },
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Micro-benchmark for building interrogation prompts as the game history grows.
+
+For each history length it builds the chat prompt the way /conversation does (memoized
+per-session prefix, precompiled suffix template, transcript rendered with a single join,
+old turns folded into a summary) and the way it used to be built (every prompt
+re-rendered from scratch with the whole history appended turn by turn), and reports the
+time and the bytes allocated per build as JSON.
+
+    python benchmarks/prompt_build.py --turns 0 10 50 200 --iterations 2000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_gemini import ANSWER, GROUND_TRUTH, SCENARIO, SUMMARY
+from prompts import alternate_guilty_prompt, format_conversation_turn
+
+QUESTION = "Where were you at the time of the murder?"
+
+
+def naive_prompt(history: List[Dict[str, str]], character: Dict[str, str]) -> str:
+    """How the prompt used to be built: everything re-rendered, history appended with +="""
+    background = {"background": SCENARIO["background"], "characters": SCENARIO["characters"]}
+    conversation_history = ""
+    for turn in history:
+        if turn["character"] == character["name"]:
+            conversation_history += format_conversation_turn(turn["character"], turn["question"], turn["answer"])
+    return alternate_guilty_prompt(QUESTION, character, background, GROUND_TRUTH, conversation_history)
+
+
+def measure(build: Callable[[], str], iterations: int) -> Dict[str, float]:
+    build()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        build()
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    build()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"us_per_build": elapsed / iterations * 1e6, "peak_bytes_per_build": peak - baseline}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--turns", type=int, nargs="+", default=[0, 5, 10, 25, 50, 100, 200], help="history lengths to measure")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    import backend
+
+    killer = GROUND_TRUTH["killer"]
+    character = next(ch for ch in SCENARIO["characters"] if ch["name"] == killer)
+    results = []
+    for turns in args.turns:
+        data = backend.StoryDetails(dict(SCENARIO, ground_truth=GROUND_TRUTH))
+        transcripts = backend.TranscriptStore(backend.TRANSCRIPT_TOKEN_BUDGET, backend.TRANSCRIPT_KEEP_RECENT)
+        history = []
+        for _ in range(turns):
+            history.append({"character": killer, "question": QUESTION, "answer": ANSWER})
+            transcript = transcripts.get(killer)
+            transcript.append(QUESTION, ANSWER)
+            if transcript.over_budget():
+                # What the background summarizer does once the transcript is over budget
+                offset, count, _ = transcript.pending_summary()
+                transcript.apply_summary(offset, count, SUMMARY)
+
+        def compiled() -> str:
+            prefix, suffix = backend.build_chat_prompt(data, killer, QUESTION, transcripts)
+            return prefix + suffix
+
+        results.append({
+            "turns": turns,
+            "prompt_chars": len(compiled()),
+            "compiled": measure(compiled, args.iterations),
+            "naive": measure(lambda: naive_prompt(history, character), args.iterations),
+        })
+
+    output = json.dumps({"iterations": args.iterations, "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import asyncio
+import hashlib
+import time
+from typing import Dict, Hashable, Optional, Tuple
+
+from google import genai
+from google.genai import errors, types
+
+from transcripts import estimate_tokens
+
+CacheKey = Tuple[Hashable, str, str]   # (session id, character, model)
+
+
+class ContextCache:
+    """
+    Registers the static per-(session, character) prompt prefix with Gemini context caching.
+
+    The first turn for a character sends the full prompt and registers the prefix in the
+    background; later turns reference the cached content and only send the per-turn suffix.
+    Caches live as long as the session: the TTL is extended while the session is in use
+    and the caches are deleted when the session is dropped. A prefix the API rejects is
+    not tried again; one that fails transiently is retried with backoff.
+    """
+
+    def __init__(
+        self,
+        client: genai.Client,
+        ttl: int = 3600,
+        min_tokens: int = 1024,
+        retry_base: float = 5.0,
+        retry_max: float = 300.0,
+    ):
+        self.client = client
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        # key -> (cache name, prefix hash, expiry)
+        self._entries: Dict[CacheKey, Tuple[str, str, float]] = {}
+        self._pending: Dict[CacheKey, asyncio.Task] = {}
+        # Keys whose prefix the API rejected outright (a 4xx other than size or rate limiting)
+        self._unsupported: Dict[CacheKey, str] = {}
+        # model -> largest estimated prefix the API refused as too small; token estimates are
+        # rough, so this catches prefixes just under the real minimum after one refusal
+        self._too_small: Dict[str, int] = {}
+        # key -> (no new attempt before, consecutive transient failures)
+        self._retry_at: Dict[CacheKey, Tuple[float, int]] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+
+    def lookup(self, session_id: Hashable, character: str, model: str, prefix: str) -> Optional[str]:
+        """
+        Returns the cached content name for this prefix if one is ready, otherwise starts
+        registering it in the background and returns None (send the full prompt this time).
+        """
+        key = (session_id, character, model)
+        tokens = estimate_tokens(prefix)
+        if tokens < self.min_tokens or tokens <= self._too_small.get(model, 0):
+            return None
+        prefix_hash = hashlib.sha256(prefix.encode()).hexdigest()
+        if self._unsupported.get(key) == prefix_hash:
+            return None
+
+        entry = self._entries.get(key)
+        now = time.time()
+        if entry is not None and entry[1] == prefix_hash and entry[2] > now + 30:
+            self.hits += 1
+            if entry[2] - now < self.ttl / 4:
+                self._start(key, self._refresh(key, entry[0]))
+            return entry[0]
+
+        self.misses += 1
+        if entry is not None:
+            self._entries.pop(key)
+            self._start(key, self._delete(entry[0]), track=False)
+        retry = self._retry_at.get(key)
+        if retry is None or retry[0] <= now:
+            self._start(key, self._create(key, model, prefix, prefix_hash, tokens))
+        return None
+
+    async def drop_session(self, session_id: Hashable):
+        """Deletes every cache that belongs to the session"""
+        keys = [key for key in self._entries if key[0] == session_id]
+        names = [self._entries.pop(key)[0] for key in keys]
+        for key in [key for key in self._pending if key[0] == session_id]:
+            self._pending.pop(key).cancel()
+        for key in [key for key in self._unsupported if key[0] == session_id]:
+            del self._unsupported[key]
+        for key in [key for key in self._retry_at if key[0] == session_id]:
+            del self._retry_at[key]
+        await asyncio.gather(*(self._delete(name) for name in names), return_exceptions=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "failures": self.failures,
+        }
+
+    def _start(self, key: CacheKey, coro, track: bool = True):
+        if track:
+            if key in self._pending and not self._pending[key].done():
+                coro.close()
+                return
+            self._pending[key] = asyncio.create_task(coro)
+        else:
+            asyncio.create_task(coro)
+
+    async def _create(self, key: CacheKey, model: str, prefix: str, prefix_hash: str, tokens: int):
+        try:
+            cache = await self.client.aio.caches.create(
+                model=f"models/gemini-{model}",
+                config=types.CreateCachedContentConfig(
+                    system_instruction=prefix,
+                    ttl=f"{self.ttl}s",
+                    display_name=f"session-{key[0]}",
+                ),
+            )
+        except errors.ClientError as e:
+            self.failures += 1
+            if e.code in (408, 429):
+                self._back_off(key)
+            elif "too small" in str(e.message).lower() or "min_total_token_count" in str(e.message):
+                self._too_small[model] = max(self._too_small.get(model, 0), tokens)
+            else:
+                self._unsupported[key] = prefix_hash
+            return
+        except Exception:
+            # Network errors and 5xx: try again on a later turn
+            self.failures += 1
+            self._back_off(key)
+            return
+        finally:
+            self._pending.pop(key, None)
+        self._retry_at.pop(key, None)
+        self._entries[key] = (cache.name, prefix_hash, time.time() + self.ttl)
+
+    def _back_off(self, key: CacheKey):
+        attempts = self._retry_at.get(key, (0.0, 0))[1] + 1
+        delay = min(self.retry_max, self.retry_base * 2 ** (attempts - 1))
+        self._retry_at[key] = (time.time() + delay, attempts)
+
+    async def _refresh(self, key: CacheKey, name: str):
+        try:
+            await self.client.aio.caches.update(
+                name=name,
+                config=types.UpdateCachedContentConfig(ttl=f"{self.ttl}s"),
+            )
+        except Exception:
+            self.failures += 1
+            self._entries.pop(key, None)
+            return
+        finally:
+            self._pending.pop(key, None)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == name:
+            self._entries[key] = (name, entry[1], time.time() + self.ttl)
+
+    async def _delete(self, name: str):
+        try:
+            await self.client.aio.caches.delete(name=name)
+        except Exception:
+            pass
@@ -0,0 +1,287 @@
+import asyncio
+import json
+import random
+import time
+from typing import AsyncIterator, Callable, Optional
+
+import httpx
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com/v1beta"
+
+# Status codes that are worth retrying: rate limiting and transient server errors
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Called after every call: (model, seconds, status, prompt, response text, usageMetadata)
+CallObserver = Callable[[str, float, str, str, str, Optional[dict]], None]
+
+
+class GeminiError(Exception):
+    """Raised when the Gemini API cannot produce a usable response"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def extract_text(response_json: dict) -> str:
+    """Pulls the generated text out of a generateContent response"""
+    try:
+        parts = response_json["candidates"][0]["content"]["parts"]
+        return "".join(part.get("text", "") for part in parts)
+    except (KeyError, IndexError, TypeError) as e:
+        raise GeminiError(f"Unexpected response format - {str(e)}")
+
+
+class GeminiClient:
+    """
+    Asyncio-native client for the Gemini REST API.
+
+    A single instance is shared by the whole app, so every request goes over the
+    same keep-alive (HTTP/2 when available) connection pool. Concurrency is capped
+    by a semaphore, each call has an overall deadline, and 429/5xx responses are
+    retried with full-jitter exponential backoff.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = GEMINI_BASE_URL,
+        timeout: float = 60.0,
+        max_concurrency: int = 16,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        observer: Optional[CallObserver] = None,
+    ):
+        self.api_key = api_key
+        self.observer = observer
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # Calls currently waiting for or holding a connection slot, including retries
+        self.in_flight = 0
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                timeout=httpx.Timeout(self.timeout, connect=10.0),
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency * 2,
+                    max_keepalive_connections=self.max_concurrency,
+                    keepalive_expiry=60.0,
+                ),
+                headers={"Content-Type": "application/json"},
+            )
+        return self._client
+
+    def _url(self, model: str, method: str) -> str:
+        return f"{self.base_url}/models/gemini-{model}:{method}"
+
+    def _request_body(self, prompt: str, cached_content: Optional[str] = None, response_schema: Optional[dict] = None) -> dict:
+        data = {
+            "contents": [
+                {"role": "user", "parts": [{"text": prompt}]}
+            ]
+        }
+        if cached_content:
+            data["cachedContent"] = cached_content
+        if response_schema:
+            data["generationConfig"] = {
+                "responseMimeType": "application/json",
+                "responseSchema": response_schema,
+            }
+        return data
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def generate(
+        self,
+        prompt: str,
+        model: str = "2.0-flash",
+        timeout: Optional[float] = None,
+        cached_content: Optional[str] = None,
+        response_schema: Optional[dict] = None,
+    ) -> str:
+        """
+        Sends the prompt to generateContent and returns the generated text.
+        With a response_schema the model is asked for JSON output matching it.
+        """
+        data = self._request_body(prompt, cached_content, response_schema)
+        started = time.perf_counter()
+        self.in_flight += 1
+        try:
+            response_json = await self._post(model, "generateContent", data, timeout)
+            text = extract_text(response_json)
+        except GeminiError as e:
+            self._observe(model, started, str(e.status_code or "error"), prompt, "", None)
+            raise
+        finally:
+            self.in_flight -= 1
+        self._observe(model, started, "200", prompt, text, response_json.get("usageMetadata"))
+        return text
+
+    async def stream(
+        self,
+        prompt: str,
+        model: str = "2.0-flash",
+        timeout: Optional[float] = None,
+        cached_content: Optional[str] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Proxies streamGenerateContent and yields text chunks as the model produces them.
+        Retries only happen before the first chunk has been yielded.
+        """
+        data = self._request_body(prompt, cached_content)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout or self.timeout)
+        client = self._get_client()
+        call_started = time.perf_counter()
+        chunks = []
+        usage = {}
+        status = "cancelled"
+        self.in_flight += 1
+        try:
+            async for text in self._stream(client, model, data, loop, deadline, usage):
+                chunks.append(text)
+                yield text
+            status = "200"
+        except GeminiError as e:
+            status = str(e.status_code or "error")
+            raise
+        finally:
+            self.in_flight -= 1
+            self._observe(model, call_started, status, prompt, "".join(chunks), usage)
+
+    async def _stream(self, client, model, data, loop, deadline, usage: dict):
+        """Yields text chunks; the latest usageMetadata is copied into usage"""
+        started = False
+
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            async with self._semaphore:
+                try:
+                    async with client.stream(
+                        "POST",
+                        self._url(model, "streamGenerateContent"),
+                        params={"key": self.api_key, "alt": "sse"},
+                        json=data,
+                        timeout=httpx.Timeout(max(deadline - loop.time(), 0.001), connect=10.0),
+                    ) as response:
+                        if response.status_code == 200:
+                            lines = response.aiter_lines()
+                            while True:
+                                # httpx's timeout is per read, so a model that keeps trickling
+                                # chunks would never trip it: bound every read by the deadline
+                                try:
+                                    line = await asyncio.wait_for(lines.__anext__(), deadline - loop.time())
+                                except StopAsyncIteration:
+                                    return
+                                except asyncio.TimeoutError:
+                                    raise GeminiError("Request timed out", status_code=504)
+                                if not line.startswith("data:"):
+                                    continue
+                                try:
+                                    chunk = json.loads(line[5:].strip())
+                                except ValueError as e:
+                                    raise GeminiError(f"Unexpected response format - {str(e)}", status_code=502)
+                                usage.update(chunk.get("usageMetadata", {}))
+                                text = extract_text(chunk)
+                                if text:
+                                    started = True
+                                    yield text
+
+                        body = (await response.aread()).decode(errors="replace")
+                        error = GeminiError(f"{response.status_code}, {body}", status_code=response.status_code)
+                        if response.status_code not in RETRY_STATUS_CODES:
+                            raise error
+                        retry_after = response.headers.get("Retry-After")
+                except httpx.TimeoutException:
+                    raise GeminiError("Request timed out", status_code=504)
+                except httpx.TransportError as e:
+                    error = GeminiError(f"Transport error - {str(e)}", status_code=502)
+                    if started:
+                        raise error
+
+            delay = self._backoff(attempt, retry_after)
+            if attempt == self.max_retries or loop.time() + delay >= deadline:
+                raise error
+            await asyncio.sleep(delay)
+
+    def _observe(self, model: str, started: float, status: str, prompt: str, text: str, usage: Optional[dict]):
+        if self.observer is not None:
+            self.observer(model, time.perf_counter() - started, status, prompt, text, usage)
+
+    async def _post(self, model: str, method: str, data: dict, timeout: Optional[float]) -> dict:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout or self.timeout)
+        client = self._get_client()
+        last_error: Optional[GeminiError] = None
+
+        for attempt in range(self.max_retries + 1):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+
+            retry_after = None
+            # The deadline covers waiting for a free slot too. asyncio.wait (unlike wait_for on
+            # Python 3.11) never swallows a cancellation of this call.
+            request = asyncio.ensure_future(self._send(client, self._url(model, method), data))
+            try:
+                done, _ = await asyncio.wait([request], timeout=remaining)
+            finally:
+                if not request.done():
+                    request.cancel()
+            if not done:
+                last_error = GeminiError("Request timed out", status_code=504)
+                break
+            try:
+                response = request.result()
+            except httpx.TransportError as e:
+                last_error = GeminiError(f"Transport error - {str(e)}", status_code=502)
+            else:
+                if response.status_code == 200:
+                    try:
+                        return response.json()
+                    except ValueError as e:
+                        raise GeminiError(f"Unexpected response format - {str(e)}", status_code=502)
+
+                last_error = GeminiError(f"{response.status_code}, {response.text}", status_code=response.status_code)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    raise last_error
+                retry_after = response.headers.get("Retry-After")
+
+            if attempt == self.max_retries:
+                break
+            delay = self._backoff(attempt, retry_after)
+            if loop.time() + delay >= deadline:
+                break
+            await asyncio.sleep(delay)
+
+        raise last_error or GeminiError("Request timed out", status_code=504)
+
+    async def _send(self, client: httpx.AsyncClient, url: str, data: dict) -> httpx.Response:
+        async with self._semaphore:
+            return await client.post(url, params={"key": self.api_key}, json=data)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,276 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+Session = Dict[str, Any]
+# Applies one event to a session (None before the session's "create" event) and returns the result
+ApplyEvent = Callable[[Optional[Session], Dict[str, Any]], Optional[Session]]
+
+
+class SessionJournal:
+    """
+    Durable, append-only journal of session events (story created, ground truth set, turns
+    recorded, ...) so games survive a restart without regenerating anything.
+
+    Events are appended as "seq<TAB>session id<TAB>json" lines to numbered segment files by
+    a background task that fsyncs once per batch; a crash loses at most the batch in flight.
+    Once the log passes compact_bytes it is rotated and the closed segments are compacted,
+    in a thread, into one zlib-compressed snapshot per session. At startup only the log tail
+    is indexed; a session is rebuilt from its snapshot plus its tail events on first access.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        apply: ApplyEvent,
+        encode: Callable[[Session], Dict[str, Any]],
+        compact_bytes: int = 32 * 1024 * 1024,
+        retention: Optional[float] = 30 * 24 * 3600,
+        max_queue: int = 100000,
+    ):
+        self.directory = directory
+        self.snapshot_dir = os.path.join(directory, "snapshots")
+        self.checkpoint_path = os.path.join(directory, "checkpoint")
+        self.apply = apply
+        self.encode = encode
+        self.compact_bytes = compact_bytes
+        self.retention = retention
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+
+        # Tail events not yet folded into a snapshot, including ones still waiting to be written
+        self._events: Dict[int, List[Tuple[int, str]]] = {}
+        self._lock = threading.Lock()
+        self._queue: "asyncio.Queue[Optional[str]]" = asyncio.Queue(maxsize=max_queue)
+        self._task: Optional[asyncio.Task] = None
+        self._compaction: Optional[asyncio.Task] = None
+        self._file = None
+
+        self.seq = 0
+        self.max_id = 0
+        self.replayed = 0
+        self.fsyncs = 0
+        self.compactions = 0
+        self.dropped = 0
+        self._open()
+
+    # ---- Startup ----
+
+    def _segments(self) -> List[str]:
+        names = sorted(name for name in os.listdir(self.directory) if name.startswith("segment-") and name.endswith(".log"))
+        return [os.path.join(self.directory, name) for name in names]
+
+    def _open(self):
+        # Sequence numbers continue after the last compaction even if the log is now empty
+        try:
+            with open(self.checkpoint_path) as f:
+                self.seq = int(f.read())
+        except FileNotFoundError:
+            pass
+        for name in os.listdir(self.snapshot_dir):
+            if name.split(".")[0].isdigit():
+                self.max_id = max(self.max_id, int(name.split(".")[0]))
+
+        segments = self._segments()
+        for path in segments:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        # Torn write from a crash: everything before it is intact
+                        break
+                    seq, session_id, event = line.rstrip("\n").split("\t", 2)
+                    seq, session_id = int(seq), int(session_id)
+                    self._events.setdefault(session_id, []).append((seq, event))
+                    self.seq = max(self.seq, seq)
+                    self.max_id = max(self.max_id, session_id)
+
+        # Never append to a segment a crash may have left half-written
+        self._active = int(os.path.basename(segments[-1])[8:-4]) + 1 if segments else 1
+        self._segment_bytes = 0
+        self._closed: List[str] = segments
+
+    def _segment(self, number: int) -> str:
+        return os.path.join(self.directory, f"segment-{number:08d}.log")
+
+    # ---- Lifecycle ----
+
+    def start(self):
+        self._task = asyncio.create_task(self._writer())
+        if self._closed:
+            # Fold whatever the previous process left in the log into snapshots
+            self._compaction = asyncio.create_task(asyncio.to_thread(self._compact, list(self._closed), self.seq))
+
+    async def stop(self):
+        """Writes out every queued event before returning"""
+        if self._task is not None:
+            await self._queue.put(None)
+            await self._task
+            self._task = None
+        if self._compaction is not None:
+            await asyncio.gather(self._compaction, return_exceptions=True)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # ---- Public API ----
+
+    def record(self, session_id: int, event: Dict[str, Any]):
+        """Appends an event for the session; it is on disk after the next batch is fsynced"""
+        self.seq += 1
+        data = json.dumps(event, separators=(",", ":"))
+        with self._lock:
+            self._events.setdefault(session_id, []).append((self.seq, data))
+        self.max_id = max(self.max_id, session_id)
+        try:
+            self._queue.put_nowait(f"{self.seq}\t{session_id}\t{data}\n")
+        except asyncio.QueueFull:
+            # Disk can't keep up; the event stays in memory and still reaches the next snapshot
+            self.dropped += 1
+
+    def load(self, session_id: int) -> Optional[Session]:
+        """Rebuilds a session from its snapshot and tail events, or None if the journal has no such session"""
+        session = self._load(session_id)
+        if session is not None:
+            self.replayed += 1
+        return session
+
+    def __contains__(self, session_id: int) -> bool:
+        return session_id in self._events or os.path.exists(self._snapshot_path(session_id))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "seq": self.seq,
+            "tail_sessions": len(self._events),
+            "segment_bytes": self._segment_bytes,
+            "queued": self._queue.qsize(),
+            "fsyncs": self.fsyncs,
+            "compactions": self.compactions,
+            "replayed": self.replayed,
+            "dropped": self.dropped,
+        }
+
+    # ---- Internals ----
+
+    def _load(self, session_id: int, upto: Optional[int] = None) -> Optional[Session]:
+        # Snapshot and tail are read together, so a concurrent compaction is seen before or after, not halfway
+        with self._lock:
+            try:
+                with open(self._snapshot_path(session_id), "rb") as f:
+                    blob = f.read()
+            except FileNotFoundError:
+                blob = None
+            events = list(self._events.get(session_id, ()))
+
+        session, after = None, 0
+        if blob is not None:
+            snapshot = json.loads(zlib.decompress(blob))
+            session = self.apply(None, {"op": "create", "session": snapshot["session"]})
+            after = snapshot["seq"]
+        for seq, event in events:
+            if seq > after and (upto is None or seq <= upto):
+                session = self.apply(session, json.loads(event))
+        return session
+
+    async def _writer(self):
+        """Writes and fsyncs everything queued since the last batch, until stop() queues None"""
+        while True:
+            lines = [await self._queue.get()]
+            while not self._queue.empty():
+                lines.append(self._queue.get_nowait())
+            stopping = None in lines
+            lines = [line for line in lines if line is not None]
+            if lines:
+                await asyncio.to_thread(self._write, lines)
+            if stopping:
+                return
+
+            if self._segment_bytes >= self.compact_bytes and (self._compaction is None or self._compaction.done()):
+                closed = self._rotate()
+                self._compaction = asyncio.create_task(asyncio.to_thread(self._compact, closed, self.seq))
+
+    def _write(self, lines: List[str]):
+        if self._file is None:
+            self._file = open(self._segment(self._active), "a", encoding="utf-8")
+            # A new segment's directory entry has to be durable too, not just its contents
+            _sync_directory(self.directory)
+        data = "".join(lines)
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._segment_bytes += len(data)
+        self.fsyncs += 1
+
+    def _rotate(self) -> List[str]:
+        """Closes the active segment and returns every segment that is ready for compaction"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._closed.append(self._segment(self._active))
+        self._active += 1
+        self._segment_bytes = 0
+        return list(self._closed)
+
+    def _compact(self, segments: List[str], upto: int):
+        """Folds every event up to seq upto into per-session snapshots, then drops the segments"""
+        with self._lock:
+            session_ids = [session_id for session_id, events in self._events.items() if events and events[0][0] <= upto]
+
+        for session_id in session_ids:
+            session = self._load(session_id, upto)
+            path = self._snapshot_path(session_id)
+            if session is not None:
+                snapshot = {"seq": upto, "session": self.encode(session)}
+                _write_synced(path + ".tmp", zlib.compress(json.dumps(snapshot, separators=(",", ":")).encode()))
+            with self._lock:
+                if session is not None:
+                    os.replace(path + ".tmp", path)
+                events = [event for event in self._events.get(session_id, ()) if event[0] > upto]
+                if events:
+                    self._events[session_id] = events
+                else:
+                    self._events.pop(session_id, None)
+
+        # The segments may only go once the snapshots and checkpoint replacing them are on disk
+        _sync_directory(self.snapshot_dir)
+        _write_synced(self.checkpoint_path + ".tmp", str(upto).encode())
+        os.replace(self.checkpoint_path + ".tmp", self.checkpoint_path)
+        _sync_directory(self.directory)
+        for path in segments:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._closed = [path for path in self._closed if path not in segments]
+
+        if self.retention is not None:
+            cutoff = time.time() - self.retention
+            for name in os.listdir(self.snapshot_dir):
+                path = os.path.join(self.snapshot_dir, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+        self.compactions += 1
+
+    def _snapshot_path(self, session_id: int) -> str:
+        return os.path.join(self.snapshot_dir, f"{int(session_id)}.json.z")
+
+
+def _write_synced(path: str, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _sync_directory(path: str):
+    """Makes renames and new files in the directory durable"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
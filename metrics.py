@@ -0,0 +1,245 @@
+import asyncio
+import contextvars
+import json
+import random
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+# Endpoint the current request (or background job) is working for; used as a label everywhere
+current_endpoint: contextvars.ContextVar[str] = contextvars.ContextVar("current_endpoint", default="none")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Iterable[Tuple[str, str]] = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (key + '="' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"' for key, value in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.type = "counter"
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_format_labels(labels)} {value}" for labels, value in self.values.items()]
+
+
+class Gauge(Counter):
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self.type = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        self.values[_labels(labels)] = value
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.type = "histogram"
+        self.buckets = buckets
+        # labels -> (bucket counts, sum, count)
+        self.values: Dict[Labels, Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels):
+        key = _labels(labels)
+        counts, total, count = self.values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        self.values[key] = (counts, total + value, count + 1)
+
+    def render(self) -> List[str]:
+        lines = []
+        for labels, (counts, total, count) in self.values.items():
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(labels, [('le', str(bound))])} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class Registry:
+    """Minimal Prometheus-style metrics registry rendered in the text exposition format"""
+
+    def __init__(self):
+        self.metrics: List = []
+        # (prefix, help, callback returning {metric name: value} read at scrape time, names of
+        # the values that are cumulative counts); the rest are gauges (pool depth, cache size, ...)
+        self.collectors: List[Tuple[str, str, Callable[[], Dict[str, float]], FrozenSet[str]]] = []
+
+    def counter(self, name: str, help: str) -> Counter:
+        metric = Counter(name, help)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        metric = Gauge(name, help)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, prefix: str, help: str, collect: Callable[[], Dict[str, float]], counters: Iterable[str] = ()):
+        """
+        Exposes the numbers in collect()'s result as {prefix}_{name}; the ones named in
+        counters only ever grow and are rendered as counters ({prefix}_{name}_total)
+        """
+        self.collectors.append((prefix, help, collect, frozenset(counters)))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        for prefix, help, collect, counters in self.collectors:
+            for name, value in collect().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    kind = "counter" if name in counters else "gauge"
+                    metric = f"{prefix}_{name}_total" if kind == "counter" else f"{prefix}_{name}"
+                    lines.append(f"# HELP {metric} {help}: {name.replace('_', ' ')}")
+                    lines.append(f"# TYPE {metric} {kind}")
+                    lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+requests_total = registry.counter("murder_requests_total", "HTTP requests by endpoint and status")
+request_seconds = registry.histogram("murder_request_seconds", "HTTP request latency by endpoint")
+requests_in_flight = registry.gauge("murder_requests_in_flight", "HTTP requests currently being served")
+stage_seconds = registry.histogram("murder_stage_seconds", "Time spent per request stage")
+model_calls_total = registry.counter("murder_model_calls_total", "Outbound model calls by endpoint, model and status")
+model_call_seconds = registry.histogram("murder_model_call_seconds", "Outbound model call latency")
+model_tokens_total = registry.counter("murder_model_tokens_total", "Prompt and response tokens reported by the model")
+model_bytes_total = registry.counter("murder_model_bytes_total", "Prompt and response text sizes in bytes")
+
+
+@contextmanager
+def stage(name: str):
+    """Times a stage of the current request"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(time.perf_counter() - started, endpoint=current_endpoint.get(), stage=name)
+
+
+def observe_model_call(model: str, seconds: float, status: str, prompt: str, response: str, usage: Optional[dict]):
+    labels = {"endpoint": current_endpoint.get(), "model": model}
+    model_calls_total.inc(status=status, **labels)
+    model_call_seconds.observe(seconds, **labels)
+    model_bytes_total.inc(len(prompt.encode()), direction="prompt", **labels)
+    model_bytes_total.inc(len(response.encode()), direction="response", **labels)
+    if usage:
+        model_tokens_total.inc(usage.get("promptTokenCount", 0), direction="prompt", **labels)
+        model_tokens_total.inc(usage.get("cachedContentTokenCount", 0), direction="cached", **labels)
+        model_tokens_total.inc(usage.get("candidatesTokenCount", 0), direction="response", **labels)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that tags each request with its endpoint, tracks in-flight requests and
+    records status and latency (including the time spent streaming the body).
+    """
+
+    def __init__(self, app, routes: List):
+        self.app = app
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Only known routes become labels, so unknown paths can't blow up the label set
+        path = scope["path"]
+        name = path if any(getattr(route, "path", None) == path for route in self.routes) else "other"
+        token = current_endpoint.set(name)
+        requests_in_flight.inc(endpoint=name)
+        started = time.perf_counter()
+        status = "500"
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            requests_in_flight.dec(endpoint=name)
+            requests_total.inc(endpoint=name, status=status)
+            request_seconds.observe(time.perf_counter() - started, endpoint=name)
+            current_endpoint.reset(token)
+
+
+class PromptLog:
+    """
+    Opt-in, sampled prompt log. Prompts are queued and appended to a JSON-lines file by a
+    background task, so logging never blocks a request; when the queue is full they are dropped.
+    """
+
+    def __init__(self, path: Optional[str], sample_rate: float = 0.0, max_queue: int = 1000):
+        self.path = path
+        self.sample_rate = sample_rate if path else 0.0
+        self.dropped = 0
+        self._queue: "asyncio.Queue[str]" = asyncio.Queue(maxsize=max_queue)
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, prompt: str, **fields):
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return
+        entry = json.dumps({"time": time.time(), "endpoint": current_endpoint.get(), **fields, "prompt": prompt})
+        try:
+            self._queue.put_nowait(entry)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def start(self):
+        if self.sample_rate > 0:
+            self._task = asyncio.create_task(self._writer())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _writer(self):
+        while True:
+            entries = [await self._queue.get()]
+            while not self._queue.empty():
+                entries.append(self._queue.get_nowait())
+            await asyncio.to_thread(self._write, entries)
+
+    def _write(self, entries: List[str]):
+        with open(self.path, "a") as f:
+            f.write("\n".join(entries) + "\n")
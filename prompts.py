@@ -1,5 +1,78 @@
-def get_alternate_backstory_prompt(difficulty, setting, murder_mode):
-    prompt = f"""
+from string import Formatter
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class PromptTemplate:
+    """
+    A prompt compiled once at import time. The text is split into literal blocks and named
+    slots up front (static slots are filled in right away), so rendering is a single join.
+    """
+
+    def __init__(self, text: str, **static: str):
+        self.parts: List[str] = []
+        self.slots: List[Tuple[int, str]] = []   # (index into parts, field name)
+        after_literal = False
+        for literal, field, _, _ in Formatter().parse(text):
+            if field in static:
+                literal += static[field]
+                field = None
+            if literal:
+                if after_literal:
+                    self.parts[-1] += literal
+                else:
+                    self.parts.append(literal)
+                after_literal = True
+            if field is not None:
+                self.slots.append((len(self.parts), field))
+                self.parts.append("")
+                after_literal = False
+
+    def render(self, **fields: Any) -> str:
+        parts = self.parts.copy()
+        for index, name in self.slots:
+            value = fields[name]
+            parts[index] = value if isinstance(value, str) else str(value)
+        return "".join(parts)
+
+
+# ---- Static blocks ----
+
+SCENARIO_JSON_EXAMPLE = """
+{
+  "background": "Brief paragraph describing the setting, victim, and context of the murder. Should hook the player. Should contain many details like where the body was found, the state of the body, who was near it or some distinct smell/look/feature of the crime scene. This will be used to generate clues/inconsistencies for the killer. The more details, the better.",
+  "characters": [
+    {
+      "name": "Full Name",
+      "description": "Publicly known information. Include age, occupation, alibi, relevant traits, past relationships with the victim, motives, etc. NO spoilers.",
+    }
+    // Repeat for 3 characters
+  ]
+}
+
+Return only the JSON. Do not include any explanation, headers, or text outside the object.
+"""
+
+GROUND_TRUTH_JSON_EXAMPLE = """
+{
+    "killer": "Name of the killer (must match character name)",
+    "method": "How the murder was committed (e.g. poison, stabbing, etc.)",
+    "motive": "True motive for the murder (not included in public description)",
+    "timeline": [
+      "7:00 PM - All characters arrive at the estate.",
+      "7:30 PM - Victim has a private conversation with Character B.",
+      "...",
+      "8:15 PM - Murder occurs.",
+      "8:30 PM - Body is discovered by Character D."
+    ],
+    "clues": [
+      "The killer subtly mentions that they use a vanilla cream (in an example where there is a faint vanilla smell around the body)",
+      "The killer lies in a way that is easily verifiable by the police by talking to another character. For example, the killer lies about going home at 6PM, but they were seen by another character near the killer at 7:30PM",
+      "The killer mentions a detail about the murder weapon before the police shared it."
+    ]
+}
+"""
+
+BACKSTORY = PromptTemplate("""
 You are a mystery scenario generator for a text-based detective game. Your job is to create a solvable murder mystery that is internally consistent and grounded in a clear ground truth.
 
 Follow these instructions carefully and return only a JSON object structured exactly as described at the end.
@@ -41,26 +114,9 @@ One character will be the murderer, but you should not reveal this in the descri
 
 3. Output JSON Format
 Return a single JSON object with the following structure. Note that this is just an example, you should tailor your response to the specific scenario.
-"""
-    prompt += """
-{
-  "background": "Brief paragraph describing the setting, victim, and context of the murder. Should hook the player. Should contain many details like where the body was found, the state of the body, who was near it or some distinct smell/look/feature of the crime scene. This will be used to generate clues/inconsistencies for the killer. The more details, the better.",
-  "characters": [
-    {
-      "name": "Full Name",
-      "description": "Publicly known information. Include age, occupation, alibi, relevant traits, past relationships with the victim, motives, etc. NO spoilers.",
-    }
-    // Repeat for 3 characters
-  ]
-}
-
-Return only the JSON. Do not include any explanation, headers, or text outside the object.
-"""
-    
-    return prompt
+{json_example}""", json_example=SCENARIO_JSON_EXAMPLE)
 
-def get_ground_truth_prompt(background, characters):
-    prompt = f"""
+GROUND_TRUTH = PromptTemplate("""
 You are a mystery scenario generator for a text-based detective game. Your job is to identify the likely suspect from the given murder scenario, along with their motive, method and timeline. You also need to generate some clues (or inconsistencies) that will be used to guide the player towards the answer. The clues should be evident from the murder scenario (do not make up facts).
 
 A mystery scenario has already been generated for you. This includes a description of the scene and information about the suspects in the murder.
@@ -80,31 +136,9 @@ Background: {background}
 Characters: {characters}
 
 Here is the format of the JSON you need to create:
-"""
-    prompt += """
-{
-    "killer": "Name of the killer (must match character name)",
-    "method": "How the murder was committed (e.g. poison, stabbing, etc.)",
-    "motive": "True motive for the murder (not included in public description)",
-    "timeline": [
-      "7:00 PM - All characters arrive at the estate.",
-      "7:30 PM - Victim has a private conversation with Character B.",
-      "...",
-      "8:15 PM - Murder occurs.",
-      "8:30 PM - Body is discovered by Character D."
-    ],
-    "clues": [
-      "The killer subtly mentions that they use a vanilla cream (in an example where there is a faint vanilla smell around the body)",
-      "The killer lies in a way that is easily verifiable by the police by talking to another character. For example, the killer lies about going home at 6PM, but they were seen by another character near the killer at 7:30PM",
-      "The killer mentions a detail about the murder weapon before the police shared it."
-    ]
-}
-"""
-
-    return prompt
+{json_example}""", json_example=GROUND_TRUTH_JSON_EXAMPLE)
 
-def get_backstory_prompt(difficulty, setting, murder_mode):
-    prompt = f"""
+OLD_BACKSTORY = PromptTemplate("""
 You are responsible for creating a text-based detective game where a player asks questions to characters and tries to solve the murder. You are responsible for creating a murder scenario of difficulty: {difficulty}. There are some rules that you need to satisfy:
 
 1. You need to create a backstory for the murder. This is typically 8 - 10 sentences. 
@@ -123,11 +157,9 @@ If you include hints that are related to a character knowing information they sh
 Some other directions:
 a. The murder should take place in a {setting}.
 b. The murder weapon should be: {murder_mode}.
-"""
-    return prompt
+""")
 
-def get_JSON_prompt(full_scenario: str):
-    prompt = f"""
+JSON_CONVERSION = PromptTemplate("""
 An LLM has generated a puzzle that simulates a detective-like text-based game. The player acts like a detective and interrogates the characters of the scenario.
 
 The scenario has a victim and 3 other characters who are potential suspects in the case. You need to return a JSON object that contains the following keys:
@@ -141,11 +173,50 @@ Your response will directly be parsed as a JSON object. Do not include any text
 
 Scenario:
 {full_scenario}
-"""
-    return prompt
+""")
 
-def alternate_guilty_prompt(question, character, background, ground_truth, conversation_history):
-    prompt = f"""
+JSON_REPAIR = PromptTemplate("""
+The following response was supposed to be a single JSON object matching the JSON schema below, but it could not be used.
+
+Error: {error}
+
+Schema:
+{schema}
+
+Response:
+{response}
+
+Fix the response so that it is valid JSON and matches the schema. Keep all of the content; only fix the structure.
+Return only the JSON. Do not include any explanation, headers, or text outside the object.
+""")
+
+SUMMARY = PromptTemplate("""
+You are keeping notes for a text-based detective game. Below is part of an interrogation between the detective and {character_name}, along with the notes taken so far.
+
+Update the notes so that they cover the whole interrogation. Keep every fact, claim, alibi, name, time and admission that {character_name} made, and any contradictions or slips. Drop small talk and repetition. Write in the third person, in at most 200 words.
+
+Notes so far:
+{summary}
+
+Interrogation:
+{conversation}
+
+Return only the updated notes.
+""")
+
+CONVERSATION_TURN = PromptTemplate("""
+Detective: {question}
+{character_name}: {answer}
+
+""")
+
+CONVERSATION_SUMMARY = PromptTemplate("""
+Summary of the earlier questioning:
+{summary}
+
+""")
+
+GUILTY_PREFIX = PromptTemplate("""
 You are roleplaying as a suspect in a murder mystery game. You are the guilty party. The player is the detective interrogating you.
 
 Here is what you must know and follow:
@@ -153,16 +224,16 @@ Here is what you must know and follow:
 Your Role:
 You are playing as the character:
 
-Name: {character['name']}
-Description: {character['description']}
+Name: {name}
+Description: {description}
 
 Important Internal Knowledge (NEVER reveal directly):
 - You did commit the murder.
-- The victim was killed by: {ground_truth['method']}
-- Your secret motive was: {ground_truth['motive']}
+- The victim was killed by: {method}
+- Your secret motive was: {motive}
 - You are hiding your guilt but will respond confidently and realistically to the detective's questions.
 - You remember your timeline and basic facts, but you may make a few subtle inconsistencies, including the following predefined red flags:
-    {ground_truth['clues']}
+    {clues}
 
 You will subtly reveal these red flags over the course of questioning. Do not dump them all at once. Let them come out naturally in responses when the context fits.
 
@@ -176,35 +247,11 @@ Rules of Conversation:
 Only speak from your character's knowledge. Don't invent facts outside the scenario or reveal ground truth that your character wouldn't know.
 
 Here's the publicly known scenario:
-Overview: {background['background']}
-Characters: {background['characters']}
-
-Here's the history of your conversation with the detective:
-"""
-    for conv in conversation_history:
-        if conv['character'] != character['name']:
-            continue
-        prompt += f"""
-Detective: {conv['question']}
-{conv['character']}: {conv['answer']}
-
-"""
-
-    prompt += f"""
-Detective (to {character['name']}): {question}
-{character['name']}:
-
-Respond in character to the detective's latest message. Use a consistent tone, realistic emotion, and personality. Subtly introduce one of the red flags where appropriate. If none fit, respond naturally.
-Do not start your response by mentioning the name of the character you are playing.
-
-Do not explain your reasoning or the ground truth in meta terms. Do not refer to this prompt or structure.
-
-Return only your response in natural dialogue.
-"""
-    return prompt
+Overview: {overview}
+Characters: {characters}
+""")
 
-def alternate_innocent_prompt(question, character, background, ground_truth, conversation_history):
-    prompt = f"""
+INNOCENT_PREFIX = PromptTemplate("""
 You are roleplaying as a suspect in a murder mystery game. You are an innocent character. The player is the detective interrogating you.
 
 Here is what you must know and follow:
@@ -212,16 +259,16 @@ Here is what you must know and follow:
 Your Role:
 You are playing as the character:
 
-Name: {character['name']}
-Description: {character['description']}
+Name: {name}
+Description: {description}
 
 Important Internal Knowledge (NEVER reveal directly):
-- The killer is: {ground_truth['killer']}
-- The victim was killed by: {ground_truth['method']}
-- Their secret motive was: {ground_truth['motive']}
+- The killer is: {killer}
+- The victim was killed by: {method}
+- Their secret motive was: {motive}
 - You will respond realistically to the detective's questions.
 - If you can do so organically, subtly introduce one of the details from the following clues:
-    {ground_truth['clues']}
+    {clues}
 
 You will subtly reveal these red flags over the course of questioning. Do not dump them all at once. Let them come out naturally in responses when the context fits.
 
@@ -232,34 +279,38 @@ Rules of Conversation:
 Only speak from your character's knowledge. Don't invent facts outside the scenario or reveal ground truth that your character wouldn't know.
 
 Here's the publicly known scenario:
-Overview: {background['background']}
-Characters: {background['characters']}
+Overview: {overview}
+Characters: {characters}
+""")
 
+GUILTY_SUFFIX = PromptTemplate("""
 Here's the history of your conversation with the detective:
-"""
-    for conv in conversation_history:
-        if conv['character'] != character['name']:
-            continue
-        prompt += f"""
-Detective: {conv['question']}
-{conv['character']}: {conv['answer']}
+{history}
+Detective (to {name}): {question}
+{name}:
 
-"""
-        
-    prompt += f"""
-Detective (to {character['name']}): {question}
-{character['name']}:
+Respond in character to the detective's latest message. Use a consistent tone, realistic emotion, and personality. Subtly introduce one of the red flags where appropriate. If none fit, respond naturally.
+Do not start your response by mentioning the name of the character you are playing.
+
+Do not explain your reasoning or the ground truth in meta terms. Do not refer to this prompt or structure.
+
+Return only your response in natural dialogue.
+""")
+
+INNOCENT_SUFFIX = PromptTemplate("""
+Here's the history of your conversation with the detective:
+{history}
+Detective (to {name}): {question}
+{name}:
 
 Respond in character to the detective's latest message. Use a consistent tone, realistic emotion, and personality. Do not start your response by mentioning the name of the character you are playing.
 
 Do not explain your reasoning or the ground truth in meta terms. Do not refer to this prompt or structure.
 
 Return only your response in natural dialogue.
-"""
-    return prompt
+""")
 
-def complete_conversation(question, character, background, conversation_history):
-    prompt = f"""
+COMPLETE_CONVERSATION = PromptTemplate("""
 You are conducting a murder-based puzzle game where a player acts like a detective and interrogates the characters of the scenario. The player can ask questions to the characters and you need to respond to them as if you are the character.
 
 The complete conversation history has been provided. You need to play the role of {character} and answer the detective's question in the given context. If there are clues you can include in the flow of the answer, make sure to subtly include them in your response. Your goal is to subtly guide the player in the direction of the guilty character.
@@ -268,15 +319,85 @@ Here's the scenario:
 {background}
 --------------------------
 And here's the conversation history:
-"""
-    for conv in conversation_history:
-        prompt += f"""
-Detective (to {conv['character']}): {conv['question']}
-{conv['character']}: {conv['answer']}
-
-"""
-    prompt += f"""
+{history}
 Detective (to {character}): {question}
 {character}:
-"""
-    return prompt
\ No newline at end of file
+""")
+
+COMPLETE_CONVERSATION_TURN = PromptTemplate("""
+Detective (to {character}): {question}
+{character}: {answer}
+
+""")
+
+
+# ---- Prompts ----
+
+def get_alternate_backstory_prompt(difficulty, setting, murder_mode):
+    return BACKSTORY.render(difficulty=difficulty, setting=setting, murder_mode=murder_mode)
+
+def get_ground_truth_prompt(background, characters):
+    return GROUND_TRUTH.render(background=background, characters=characters)
+
+def get_backstory_prompt(difficulty, setting, murder_mode):
+    return OLD_BACKSTORY.render(difficulty=difficulty, setting=setting, murder_mode=murder_mode)
+
+def get_JSON_prompt(full_scenario: str):
+    return JSON_CONVERSION.render(full_scenario=full_scenario)
+
+def get_json_repair_prompt(response, error, schema):
+    return JSON_REPAIR.render(response=response, error=error, schema=schema)
+
+def format_conversation_turn(character_name, question, answer):
+    return CONVERSATION_TURN.render(character_name=character_name, question=question, answer=answer)
+
+def format_conversation_summary(summary):
+    return CONVERSATION_SUMMARY.render(summary=summary)
+
+def get_summary_prompt(character_name, summary, conversation):
+    return SUMMARY.render(character_name=character_name, summary=summary if summary else "(none)", conversation=conversation)
+
+def scenario_fragments(background, ground_truth) -> Dict[str, str]:
+    """
+    The per-scenario parts of the interrogation prompts (overview, character list, clues and
+    the ground truth the characters know), rendered once so every turn can reuse them
+    """
+    return {
+        "overview": background['background'],
+        "characters": str(background['characters']),
+        "killer": ground_truth['killer'],
+        "method": ground_truth['method'],
+        "motive": ground_truth['motive'],
+        "clues": str(ground_truth['clues']),
+    }
+
+def alternate_guilty_prefix(character, background, ground_truth, fragments: Optional[Dict[str, str]] = None):
+    """The part of the guilty prompt that stays the same on every turn"""
+    fragments = fragments or scenario_fragments(background, ground_truth)
+    return GUILTY_PREFIX.render(name=character['name'], description=character['description'], **fragments)
+
+def alternate_guilty_suffix(question, character, conversation_history):
+    """The per-turn part of the guilty prompt: conversation history and the latest question"""
+    return GUILTY_SUFFIX.render(history=conversation_history, name=character['name'], question=question)
+
+def alternate_innocent_prefix(character, background, ground_truth, fragments: Optional[Dict[str, str]] = None):
+    """The part of the innocent prompt that stays the same on every turn"""
+    fragments = fragments or scenario_fragments(background, ground_truth)
+    return INNOCENT_PREFIX.render(name=character['name'], description=character['description'], **fragments)
+
+def alternate_innocent_suffix(question, character, conversation_history):
+    """The per-turn part of the innocent prompt: conversation history and the latest question"""
+    return INNOCENT_SUFFIX.render(history=conversation_history, name=character['name'], question=question)
+
+def alternate_guilty_prompt(question, character, background, ground_truth, conversation_history):
+    return alternate_guilty_prefix(character, background, ground_truth) + alternate_guilty_suffix(question, character, conversation_history)
+
+def alternate_innocent_prompt(question, character, background, ground_truth, conversation_history):
+    return alternate_innocent_prefix(character, background, ground_truth) + alternate_innocent_suffix(question, character, conversation_history)
+
+def complete_conversation(question, character, background, conversation_history):
+    history = "".join(
+        COMPLETE_CONVERSATION_TURN.render(character=conv['character'], question=conv['question'], answer=conv['answer'])
+        for conv in conversation_history
+    )
+    return COMPLETE_CONVERSATION.render(character=character, background=background, history=history, question=question)
@@ -0,0 +1,133 @@
+import hashlib
+import math
+import re
+from collections import OrderedDict
+from typing import Callable, Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+# (scenario id, character, history state) -> the questions answered in that state
+BucketKey = Tuple[str, str, str]
+Vector = Sequence[float]
+
+_punctuation = re.compile(r"[^\w\s']")
+_whitespace = re.compile(r"\s+")
+
+# Words that don't change what a question is about; everything else (names, times, places,
+# objects, verbs) has to match for two questions to share an answer
+STOP_WORDS = frozenset("""
+    a an the and or but of to in on at by for with from about as into near
+    i me my you your yours he him his she her hers it its we us our they them their
+    is are was were be been being am do does did have has had can could would should will shall may might
+    what who whom whose which when where why how that this these those there then
+    so just really ever exactly please tell say said any anything anyone
+""".split())
+
+
+def normalize_question(question: str) -> str:
+    question = _punctuation.sub(" ", question.lower())
+    return _whitespace.sub(" ", question).strip()
+
+
+def content_words(normalized: str) -> FrozenSet[str]:
+    return frozenset(word for word in normalized.split() if word not in STOP_WORDS)
+
+
+def cosine(a: Vector, b: Vector) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a) * sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class ResponseCache:
+    """
+    Cache of interrogation answers keyed by (scenario, character, normalized question,
+    history state). Bounded to max_entries with LRU eviction.
+
+    By default a question only matches exactly (after normalization). Rephrasings can be
+    matched too by passing a real embedding function and a similarity threshold; even then
+    a cached answer is only reused if both questions have the same content words, since
+    "Did you see Alice…" and "Did you see Bob…" are close in any embedding but must not
+    share an answer.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        similarity_threshold: Optional[float] = None,
+        embed: Optional[Callable[[str], Vector]] = None,
+    ):
+        if (similarity_threshold is None) != (embed is None):
+            raise ValueError("Similarity matching needs both an embedding function and a threshold")
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.embed = embed
+        # (bucket, normalized question) -> (answer, embedding if matching by similarity, latency of the model call it saved)
+        self._entries: "OrderedDict[Tuple[BucketKey, str], Tuple[str, Optional[Vector], float]]" = OrderedDict()
+        self._buckets: Dict[BucketKey, List[str]] = {}
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    @staticmethod
+    def history_state(transcript_text: str) -> str:
+        return hashlib.blake2b(transcript_text.encode(), digest_size=16).hexdigest()
+
+    def lookup(self, scenario_id: str, character: str, history_state: str, question: str) -> Optional[str]:
+        bucket = (scenario_id, character, history_state)
+        normalized = normalize_question(question)
+
+        entry = self._entries.get((bucket, normalized))
+        if entry is not None:
+            self._entries.move_to_end((bucket, normalized))
+            self.exact_hits += 1
+            self.saved_seconds += entry[2]
+            return entry[0]
+
+        candidates = self._buckets.get(bucket) if self.embed is not None else None
+        if candidates:
+            words = content_words(normalized)
+            candidates = [candidate for candidate in candidates if content_words(candidate) == words]
+        if candidates:
+            vector = self.embed(normalized)
+            best, best_score = None, self.similarity_threshold
+            for candidate in candidates:
+                score = cosine(vector, self._entries[(bucket, candidate)][1])
+                if score >= best_score:
+                    best, best_score = candidate, score
+            if best is not None:
+                answer, _, saved = self._entries[(bucket, best)]
+                self._entries.move_to_end((bucket, best))
+                self.semantic_hits += 1
+                self.saved_seconds += saved
+                return answer
+
+        self.misses += 1
+        return None
+
+    def store(self, scenario_id: str, character: str, history_state: str, question: str, answer: str, latency: float):
+        bucket = (scenario_id, character, history_state)
+        normalized = normalize_question(question)
+        key = (bucket, normalized)
+        if key not in self._entries:
+            self._buckets.setdefault(bucket, []).append(normalized)
+        self._entries[key] = (answer, self.embed(normalized) if self.embed is not None else None, latency)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            (old_bucket, old_question), _ = self._entries.popitem(last=False)
+            questions = self._buckets[old_bucket]
+            questions.remove(old_question)
+            if not questions:
+                del self._buckets[old_bucket]
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+            "saved_seconds": self.saved_seconds,
+        }
@@ -0,0 +1,271 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+from gemini_client import RETRY_STATUS_CODES, GeminiError
+from scheduler import SchedulerBusy
+
+T = TypeVar("T")
+
+# endpoint -> {minimum game difficulty: models in order of preference}
+ModelTable = Dict[str, Dict[int, List[str]]]
+# Makes one attempt with the given model and the time left until the call's deadline
+ModelCall = Callable[[str, float], Awaitable[T]]
+ModelStream = Callable[[str, float], AsyncIterator[str]]
+
+
+def model_failure(error: GeminiError) -> bool:
+    """
+    Whether the error says something about the model (rate limited, failing, timed out or
+    answering garbage) rather than about the request, which another model would reject too
+    """
+    return error.status_code is None or error.status_code in RETRY_STATUS_CODES or error.status_code >= 500
+
+
+class ModelStats:
+    """Latency and outcome of a model's recent calls, over the last window seconds"""
+
+    def __init__(self, window: float = 60.0, max_samples: int = 200):
+        self.window = window
+        # (when, seconds, ok); ok is None for attempts cancelled after losing a hedge
+        self._samples: Deque[Tuple[float, float, Optional[bool]]] = deque(maxlen=max_samples)
+
+    def add(self, seconds: float, ok: Optional[bool]):
+        self._samples.append((time.monotonic(), seconds, ok))
+
+    def _trim(self):
+        cutoff = time.monotonic() - self.window
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+
+    @property
+    def count(self) -> int:
+        self._trim()
+        return len(self._samples)
+
+    @property
+    def error_rate(self) -> float:
+        self._trim()
+        outcomes = [ok for _, _, ok in self._samples if ok is not None]
+        return outcomes.count(False) / len(outcomes) if outcomes else 0.0
+
+    def percentile(self, q: float) -> float:
+        self._trim()
+        latencies = sorted(seconds for _, seconds, _ in self._samples)
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+
+class ModelRouter:
+    """
+    Picks the models for each call from a per-endpoint, per-difficulty table and keeps
+    latency bounded when one of them degrades.
+
+    Rolling latency and error rates are kept per (endpoint, model); a model whose error
+    rate or p95 latency is over the limit goes behind the healthy ones until its window
+    clears. A call that fails moves on to the next model within the same deadline. On
+    endpoints with a hedge delay, a second request goes to the next model once the first
+    has run that long (or for the primary's p95, if sooner) and whichever answers first
+    wins. Hedges are capped at hedge_ratio of calls, so a general slowdown can't double
+    the load. Only model failures (see model_failure) fail over and count as errors; a
+    rejected request is raised as is. An attempt the scheduler turns away (SchedulerBusy)
+    never reached the model: a turned-away hedge is simply not sent, and the call keeps
+    waiting on the attempt already running.
+    """
+
+    def __init__(
+        self,
+        table: ModelTable,
+        hedge_after: Optional[Dict[str, float]] = None,
+        slow_after: Optional[Dict[str, float]] = None,
+        window: float = 60.0,
+        min_samples: int = 10,
+        max_error_rate: float = 0.25,
+        hedge_ratio: float = 0.1,
+        hedge_burst: float = 5.0,
+    ):
+        self.table = table
+        self.hedge_after = hedge_after or {}
+        self.slow_after = slow_after or {}
+        self.window = window
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.hedge_ratio = hedge_ratio
+        self.hedge_burst = hedge_burst
+        self._hedge_tokens = hedge_burst
+        self._stats: Dict[Tuple[str, str], ModelStats] = {}
+
+        self.calls = 0
+        self.rerouted = 0
+        self.failovers = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def models(self, endpoint: str, difficulty: Optional[int] = None) -> List[str]:
+        """
+        The endpoint's models for this difficulty (the row with the highest minimum not above
+        it), healthy ones first
+        """
+        rows = self.table[endpoint]
+        eligible = [minimum for minimum in rows if difficulty is None or minimum <= difficulty]
+        row = rows[max(eligible)] if eligible else rows[min(rows)]
+        healthy = [model for model in row if self.healthy(endpoint, model)]
+        if healthy and healthy[0] != row[0]:
+            self.rerouted += 1
+        return healthy + [model for model in row if model not in healthy]
+
+    def healthy(self, endpoint: str, model: str) -> bool:
+        stats = self._stats.get((endpoint, model))
+        if stats is None or stats.count < self.min_samples:
+            return True
+        slow_after = self.slow_after.get(endpoint)
+        if slow_after is not None and stats.percentile(0.95) > slow_after:
+            return False
+        return stats.error_rate < self.max_error_rate
+
+    async def call(self, endpoint: str, models: List[str], call: ModelCall, timeout: float, hedge: bool = True) -> T:
+        """Runs call against models (as returned by models()) until one answers or the deadline passes"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        self.calls += 1
+        self._hedge_tokens = min(self.hedge_burst, self._hedge_tokens + self.hedge_ratio)
+
+        delay = self._hedge_delay(endpoint, models[0]) if hedge else None
+        hedge_at = None if delay is None else loop.time() + delay
+        queue = list(models)
+        running: Dict[asyncio.Task, Tuple[str, float]] = {}
+        hedge_task = None
+        last_error: Optional[GeminiError] = None
+
+        def launch(model: str) -> asyncio.Task:
+            task = asyncio.create_task(call(model, deadline - loop.time()))
+            running[task] = (model, loop.time())
+            return task
+
+        launch(queue.pop(0))
+        try:
+            while running:
+                wake = deadline if hedge_at is None else min(deadline, hedge_at)
+                done, _ = await asyncio.wait(running, timeout=max(0.0, wake - loop.time()), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    model, started = running.pop(task)
+                    try:
+                        result = task.result()
+                    except SchedulerBusy:
+                        if not running:
+                            raise
+                        if model != models[0] and model not in queue:
+                            # Not tried, so still there to fail over to
+                            queue.insert(0, model)
+                        continue
+                    except GeminiError as e:
+                        if not model_failure(e):
+                            raise
+                        self._model_stats(endpoint, model).add(loop.time() - started, False)
+                        last_error = e
+                        continue
+                    self._model_stats(endpoint, model).add(loop.time() - started, True)
+                    if task is hedge_task:
+                        self.hedge_wins += 1
+                    return result
+
+                if loop.time() >= deadline:
+                    break
+                if done and not running:
+                    # Everything tried so far failed: move on to the next model
+                    if not queue:
+                        break
+                    self.failovers += 1
+                    hedge_at = None
+                    launch(queue.pop(0))
+                elif hedge_at is not None and loop.time() >= hedge_at:
+                    hedge_at = None
+                    if self._hedge_tokens >= 1:
+                        self._hedge_tokens -= 1
+                        self.hedged += 1
+                        # With a single model, a second request to it still dodges a slow replica
+                        hedge_task = launch(queue.pop(0) if queue else models[0])
+        finally:
+            for task, (model, started) in running.items():
+                if task.done():
+                    task.cancelled() or task.exception()
+                else:
+                    task.cancel()
+                    # It was at least this slow
+                    self._model_stats(endpoint, model).add(loop.time() - started, None)
+        raise last_error or GeminiError(f"No {endpoint} model answered within {timeout:.0f}s", status_code=504)
+
+    async def stream(self, endpoint: str, models: List[str], open_stream: ModelStream, timeout: float) -> AsyncIterator[str]:
+        """
+        Streams from the first model that starts answering. A model that fails (see
+        model_failure) before its first chunk is skipped; other errors, and any error once
+        chunks have been sent, are raised as they are.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        self.calls += 1
+        last_error: Optional[GeminiError] = None
+
+        for attempt, model in enumerate(models):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            if attempt:
+                self.failovers += 1
+            started = loop.time()
+            streamed = False
+            chunks = open_stream(model, remaining)
+            try:
+                async for chunk in chunks:
+                    streamed = True
+                    yield chunk
+            except GeminiError as e:
+                if not model_failure(e):
+                    raise
+                self._model_stats(endpoint, model).add(loop.time() - started, False)
+                if streamed:
+                    raise
+                last_error = e
+                continue
+            finally:
+                await chunks.aclose()
+            self._model_stats(endpoint, model).add(loop.time() - started, True)
+            return
+        raise last_error or GeminiError(f"No {endpoint} model answered within {timeout:.0f}s", status_code=504)
+
+    def stats(self) -> Dict[str, Any]:
+        """Call counters, plus per (endpoint, model) rolling stats under "models" """
+        models = {}
+        for (endpoint, model), stats in self._stats.items():
+            models[f"{endpoint}/{model}"] = {
+                "samples": stats.count,
+                "error_rate": stats.error_rate,
+                "p50": stats.percentile(0.5),
+                "p95": stats.percentile(0.95),
+                "healthy": self.healthy(endpoint, model),
+            }
+        return {
+            "calls": self.calls,
+            "rerouted": self.rerouted,
+            "failovers": self.failovers,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "models": models,
+        }
+
+    def _model_stats(self, endpoint: str, model: str) -> ModelStats:
+        stats = self._stats.get((endpoint, model))
+        if stats is None:
+            stats = self._stats[(endpoint, model)] = ModelStats(self.window)
+        return stats
+
+    def _hedge_delay(self, endpoint: str, model: str) -> Optional[float]:
+        delay = self.hedge_after.get(endpoint)
+        if delay is None:
+            return None
+        stats = self._stats.get((endpoint, model))
+        if stats is not None and stats.count >= self.min_samples:
+            delay = min(delay, stats.percentile(0.95))
+        return delay
@@ -0,0 +1,208 @@
+import asyncio
+import copy
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+ScenarioKey = Tuple[int, str, str]   # (difficulty, setting, murder_mode)
+
+
+def make_key(difficulty: int, setting: str, murder_mode: str) -> ScenarioKey:
+    return (int(difficulty), setting.strip().lower(), murder_mode.strip().lower())
+
+
+class ScenarioPool:
+    """
+    Background pool of fully built scenarios (background, characters and ground truth).
+
+    Each configured (difficulty, setting, murder_mode) key is kept topped up to its target
+    depth by a set of refill workers. Scenarios older than max_age are expired, and keys
+    that were only added because players kept asking for them are dropped again once they
+    have not been requested for dynamic_key_ttl seconds. Each scenario is served to up to
+    shares players (as separate copies), so games started from it can share cached answers.
+    """
+
+    def __init__(
+        self,
+        builder: Callable[[int, str, str], Awaitable[Dict[str, Any]]],
+        targets: Dict[ScenarioKey, int],
+        max_age: float = 6 * 3600,
+        workers: int = 2,
+        dynamic_depth: int = 1,
+        dynamic_after_misses: int = 3,
+        max_dynamic_keys: int = 8,
+        dynamic_key_ttl: float = 3600,
+        shares: int = 1,
+    ):
+        self.builder = builder
+        self.targets: Dict[ScenarioKey, int] = {make_key(*key): depth for key, depth in targets.items()}
+        self.max_age = max_age
+        self.num_workers = workers
+        self.dynamic_depth = dynamic_depth
+        self.dynamic_after_misses = dynamic_after_misses
+        self.max_dynamic_keys = max_dynamic_keys
+        self.dynamic_key_ttl = dynamic_key_ttl
+        self.shares = shares
+
+        # key -> (built at, scenario, players served so far)
+        self._scenarios: Dict[ScenarioKey, Deque[Tuple[float, Dict[str, Any], int]]] = {}
+        self._pending: Dict[ScenarioKey, int] = {}
+        self._queue: "asyncio.Queue[Tuple[ScenarioKey, float]]" = asyncio.Queue()
+        self._workers: list = []
+        self._dynamic_keys: Dict[ScenarioKey, float] = {}   # key -> last requested
+        self._miss_counts: Dict[ScenarioKey, int] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.refills = 0
+        self.refill_failures = 0
+        self.last_refill_lag = 0.0
+        self.max_refill_lag = 0.0
+        self._total_refill_lag = 0.0
+
+    # ---- Lifecycle ----
+
+    async def start(self):
+        for _ in range(self.num_workers):
+            self._workers.append(asyncio.create_task(self._worker()))
+        for key in self.targets:
+            self._schedule_refill(key)
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    # ---- Public API ----
+
+    def take(self, difficulty: int, setting: str, murder_mode: str) -> Optional[Dict[str, Any]]:
+        """Hands out a ready scenario for the key, or None on a pool miss"""
+        key = make_key(difficulty, setting, murder_mode)
+        if key in self._dynamic_keys:
+            self._dynamic_keys[key] = time.monotonic()
+
+        self._expire(key)
+        scenarios = self._scenarios.get(key)
+        if scenarios:
+            built_at, scenario, served = scenarios[0]
+            if served + 1 >= self.shares:
+                scenarios.popleft()
+                self._schedule_refill(key)
+            else:
+                scenarios[0] = (built_at, scenario, served + 1)
+            self.hits += 1
+            return copy.deepcopy(scenario)
+
+        self.misses += 1
+        self._record_miss(key)
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        requests = self.hits + self.misses
+        keys = set(self.targets) | set(self._dynamic_keys)
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0.0,
+            "expired": self.expired,
+            "refills": self.refills,
+            "refill_failures": self.refill_failures,
+            "refill_queue": self._queue.qsize(),
+            "last_refill_lag": self.last_refill_lag,
+            "avg_refill_lag": self._total_refill_lag / self.refills if self.refills else 0.0,
+            "max_refill_lag": self.max_refill_lag,
+            "depth": {
+                "|".join(map(str, key)): {
+                    "ready": len(self._scenarios.get(key, ())),
+                    "pending": self._pending.get(key, 0),
+                    "target": self._target(key),
+                }
+                for key in sorted(keys)
+            },
+        }
+
+    # ---- Internals ----
+
+    def _target(self, key: ScenarioKey) -> int:
+        if key in self.targets:
+            return self.targets[key]
+        if key in self._dynamic_keys:
+            return self.dynamic_depth
+        return 0
+
+    def _expire(self, key: ScenarioKey):
+        scenarios = self._scenarios.get(key)
+        now = time.monotonic()
+        while scenarios and now - scenarios[0][0] > self.max_age:
+            scenarios.popleft()
+            self.expired += 1
+
+    def _record_miss(self, key: ScenarioKey):
+        if key in self.targets or key in self._dynamic_keys:
+            self._schedule_refill(key)
+            return
+
+        self._miss_counts[key] = self._miss_counts.get(key, 0) + 1
+        if self._miss_counts[key] < self.dynamic_after_misses:
+            return
+
+        # Popular enough to pool: make room by evicting the least recently requested dynamic key
+        del self._miss_counts[key]
+        if len(self._dynamic_keys) >= self.max_dynamic_keys:
+            oldest = min(self._dynamic_keys, key=self._dynamic_keys.get)
+            self._drop_dynamic_key(oldest)
+        self._dynamic_keys[key] = time.monotonic()
+        self._schedule_refill(key)
+
+    def _drop_dynamic_key(self, key: ScenarioKey):
+        self._dynamic_keys.pop(key, None)
+        self._scenarios.pop(key, None)
+
+    def _schedule_refill(self, key: ScenarioKey):
+        have = len(self._scenarios.get(key, ())) + self._pending.get(key, 0)
+        now = time.monotonic()
+        for _ in range(self._target(key) - have):
+            self._pending[key] = self._pending.get(key, 0) + 1
+            self._queue.put_nowait((key, now))
+
+    async def _worker(self):
+        failures = 0
+        while True:
+            key, requested_at = await self._queue.get()
+            try:
+                if self._target(key) == 0:
+                    continue
+                last_requested = self._dynamic_keys.get(key)
+                if last_requested is not None and time.monotonic() - last_requested > self.dynamic_key_ttl:
+                    self._drop_dynamic_key(key)
+                    continue
+
+                try:
+                    scenario = await self.builder(*key)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    self.refill_failures += 1
+                    failures += 1
+                    # Back off so a bad key or an outage does not burn quota in a tight loop
+                    await asyncio.sleep(min(300.0, 2.0 ** failures))
+                    self._queue.put_nowait((key, requested_at))
+                    self._pending[key] = self._pending.get(key, 0) + 1
+                    continue
+
+                failures = 0
+                if self._target(key) == 0:
+                    continue
+                self._scenarios.setdefault(key, deque()).append((time.monotonic(), scenario, 0))
+                self._expire(key)
+
+                lag = time.monotonic() - requested_at
+                self.refills += 1
+                self.last_refill_lag = lag
+                self.max_refill_lag = max(self.max_refill_lag, lag)
+                self._total_refill_lag += lag
+            finally:
+                self._pending[key] = max(0, self._pending.get(key, 0) - 1)
+                self._queue.task_done()
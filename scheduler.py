@@ -0,0 +1,228 @@
+import asyncio
+import contextvars
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+# Priority classes, most urgent first
+CHAT, GROUND_TRUTH, STORY, BACKGROUND = range(4)
+PRIORITY_NAMES = ["chat", "ground_truth", "story", "background"]
+
+# Class and session of the work the current request (or background job) is doing
+current_priority: contextvars.ContextVar[int] = contextvars.ContextVar("current_priority", default=BACKGROUND)
+current_session: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("current_session", default=None)
+
+
+def classify(priority: int, session_id: Optional[int] = None):
+    """Tags model calls made from here on with a priority class and the session they are for"""
+    current_priority.set(priority)
+    current_session.set(session_id)
+
+
+class SchedulerBusy(Exception):
+    """Raised instead of queueing when a priority class already has too many calls waiting"""
+
+    def __init__(self, priority: int, retry_after: int):
+        super().__init__(f"Too many {PRIORITY_NAMES[priority]} requests queued, retry in {retry_after}s")
+        self.priority = priority
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Refills continuously at per_minute / 60 per second, holding at most one minute's worth"""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+
+class _Waiter:
+    __slots__ = ("model", "cost", "future", "queued")
+
+    def __init__(self, model: str, cost: int, future: asyncio.Future):
+        self.model = model
+        self.cost = cost
+        self.future = future
+        self.queued = time.monotonic()
+
+
+class ModelScheduler:
+    """
+    Central gate for outbound model calls.
+
+    At most max_concurrency calls run at once. Free slots go to the most urgent priority
+    class first and, within a class, round-robin across sessions so one busy game can't
+    starve the others. A call is only released when its model's request and token buckets
+    (sized to the per-minute quota) can pay for it. When a class already has max_queue
+    calls waiting, new ones are rejected with SchedulerBusy rather than left to time out.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 16,
+        rate_limits: Optional[Dict[str, Tuple[int, int]]] = None,
+        max_queue: Optional[Dict[int, int]] = None,
+    ):
+        self.max_concurrency = max_concurrency
+        # model -> (requests per minute, tokens per minute) buckets; models without limits aren't rate limited
+        self._buckets: Dict[str, Tuple[TokenBucket, TokenBucket]] = {
+            model: (TokenBucket(rpm), TokenBucket(tpm)) for model, (rpm, tpm) in (rate_limits or {}).items()
+        }
+        self.max_queue = max_queue or {}
+        # One queue per priority class: session -> that session's waiting calls, in round-robin order
+        self._queues: List["OrderedDict[Optional[int], Deque[_Waiter]]"] = [OrderedDict() for _ in PRIORITY_NAMES]
+        self._queued = [0] * len(PRIORITY_NAMES)
+        self._active = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._avg_seconds = 1.0
+
+        self.granted = [0] * len(PRIORITY_NAMES)
+        self.rejected = [0] * len(PRIORITY_NAMES)
+        self.wait_seconds = [0.0] * len(PRIORITY_NAMES)
+        self.rate_limited = 0
+
+    def admit(self, priority: Optional[int] = None):
+        """Raises SchedulerBusy if a call of this class would have to join an overfull queue"""
+        priority = current_priority.get() if priority is None else priority
+        limit = self.max_queue.get(priority)
+        if limit is not None and self._queued[priority] >= limit:
+            self.rejected[priority] += 1
+            ahead = sum(self._queued[:priority + 1])
+            retry_after = max(1, math.ceil(ahead * self._avg_seconds / self.max_concurrency))
+            raise SchedulerBusy(priority, retry_after)
+
+    @asynccontextmanager
+    async def slot(self, model: str, cost: int):
+        """Waits for a turn to call model with a request of about cost tokens"""
+        priority = current_priority.get()
+        session = current_session.get()
+        self.admit(priority)
+
+        waiter = _Waiter(model, cost, asyncio.get_running_loop().create_future())
+        self._queues[priority].setdefault(session, deque()).append(waiter)
+        self._queued[priority] += 1
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted just as the caller went away: hand the slot on
+                self._release(0.0)
+            else:
+                self._remove(priority, session, waiter)
+            raise
+
+        started = time.monotonic()
+        self.wait_seconds[priority] += started - waiter.queued
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - started)
+
+    def stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {"active": self._active, "rate_limited": self.rate_limited}
+        for priority, name in enumerate(PRIORITY_NAMES):
+            stats[f"queued_{name}"] = self._queued[priority]
+            stats[f"granted_{name}"] = self.granted[priority]
+            stats[f"rejected_{name}"] = self.rejected[priority]
+            stats[f"mean_wait_{name}"] = self.wait_seconds[priority] / self.granted[priority] if self.granted[priority] else 0.0
+        return stats
+
+    def _release(self, seconds: float):
+        self._active -= 1
+        if seconds:
+            self._avg_seconds += 0.1 * (seconds - self._avg_seconds)
+        self._dispatch()
+
+    def _remove(self, priority: int, session: Optional[int], waiter: _Waiter):
+        waiters = self._queues[priority].get(session)
+        if waiters is not None and waiter in waiters:
+            waiters.remove(waiter)
+            self._queued[priority] -= 1
+            if not waiters:
+                del self._queues[priority][session]
+
+    def _rate_wait(self, waiter: _Waiter) -> float:
+        buckets = self._buckets.get(waiter.model)
+        if buckets is None:
+            return 0.0
+        requests, tokens = buckets
+        return max(requests.wait_time(1), tokens.wait_time(waiter.cost))
+
+    def _next(self) -> Tuple[Optional[Tuple[int, Optional[int]]], Optional[float]]:
+        """The (class, session) whose next call can go now, and how long until a rate-limited one could"""
+        blocked = set()
+        retry: Optional[float] = None
+        for priority, sessions in enumerate(self._queues):
+            for session, waiters in sessions.items():
+                model = waiters[0].model
+                if model in blocked:
+                    continue
+                wait = self._rate_wait(waiters[0])
+                if wait > 0:
+                    # Lower classes may not take this model's quota ahead of the waiting call
+                    blocked.add(model)
+                    retry = wait if retry is None else min(retry, wait)
+                    continue
+                return (priority, session), retry
+        return None, retry
+
+    def _dispatch(self):
+        while self._active < self.max_concurrency:
+            turn, retry = self._next()
+            if turn is None:
+                if retry is not None:
+                    self.rate_limited += 1
+                    self._schedule(retry)
+                return
+
+            priority, session = turn
+            sessions = self._queues[priority]
+            waiters = sessions[session]
+            waiter = waiters.popleft()
+            if waiters:
+                sessions.move_to_end(session)
+            else:
+                del sessions[session]
+            self._queued[priority] -= 1
+            if waiter.future.done():
+                # Cancelled while queued
+                continue
+
+            buckets = self._buckets.get(waiter.model)
+            if buckets is not None:
+                buckets[0].take(1)
+                buckets[1].take(waiter.cost)
+            self._active += 1
+            self.granted[priority] += 1
+            waiter.future.set_result(None)
+
+    def _schedule(self, delay: float):
+        loop = asyncio.get_running_loop()
+        if self._timer is not None and self._timer.when() <= loop.time() + delay:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = loop.call_later(delay, self._wake)
+
+    def _wake(self):
+        self._timer = None
+        self._dispatch()
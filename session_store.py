@@ -0,0 +1,394 @@
+import asyncio
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, Optional
+
+Session = Dict[str, Any]
+
+
+class SessionStore:
+    """
+    Where game sessions live. Every change to a session goes through update(), which
+    applies the change atomically against the latest stored version of that session.
+    """
+
+    def create(self, session: Session) -> int:
+        """Stores a new session and returns its (collision-free) id"""
+        raise NotImplementedError
+
+    def get(self, session_id: int) -> Optional[Session]:
+        raise NotImplementedError
+
+    def update(self, session_id: int, fn: Callable[[Session], Any]) -> Any:
+        """Applies fn to the session and persists the result; returns what fn returns"""
+        raise NotImplementedError
+
+    def delete(self, session_id: int):
+        raise NotImplementedError
+
+    def ids(self) -> Iterator[int]:
+        raise NotImplementedError
+
+    def sweep(self):
+        """Expires idle sessions; called periodically"""
+
+    def stats(self) -> Dict[str, Any]:
+        return {"sessions": len(self)}
+
+    def __contains__(self, session_id: int) -> bool:
+        return self.get(session_id) is not None
+
+    def __getitem__(self, session_id: int) -> Session:
+        session = self.get(session_id)
+        if session is None:
+            raise KeyError(session_id)
+        return session
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.ids())
+
+    # ---- Async access ----
+    # What request handlers and background jobs use. These call the methods above inline;
+    # a store that blocks on I/O overrides them to run off the event loop.
+
+    async def acreate(self, session: Session) -> int:
+        return self.create(session)
+
+    async def aget(self, session_id: int) -> Optional[Session]:
+        return self.get(session_id)
+
+    async def aupdate(self, session_id: int, fn: Callable[[Session], Any]) -> Any:
+        return self.update(session_id, fn)
+
+    async def asweep(self):
+        self.sweep()
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    Keeps live session objects in a dict. Only valid for a single worker process.
+
+    Optionally bounded: sessions idle for longer than idle_ttl are expired, and once more
+    than max_sessions are live the least recently used one is evicted. With a spill_dir,
+    evicted sessions are written to disk and transparently reloaded on their next access.
+    A loader is asked for sessions that are in neither place (e.g. rebuilt from a journal
+    after a restart); ids then start at first_id. sizeof gives a per-session byte estimate
+    for the stats.
+    """
+
+    def __init__(
+        self,
+        max_sessions: Optional[int] = None,
+        idle_ttl: Optional[float] = None,
+        spill_dir: Optional[str] = None,
+        spill_ttl: float = 7 * 24 * 3600,
+        encode: Optional[Callable[[Session], Dict[str, Any]]] = None,
+        decode: Optional[Callable[[Dict[str, Any]], Session]] = None,
+        sizeof: Optional[Callable[[Session], int]] = None,
+        on_evict: Optional[Callable[[int], None]] = None,
+        loader: Optional[Callable[[int], Optional[Session]]] = None,
+        first_id: int = 1,
+    ):
+        if spill_dir and (encode is None or decode is None):
+            raise ValueError("Spilling sessions to disk needs encode and decode")
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.spill_dir = spill_dir
+        self.spill_ttl = spill_ttl
+        self.encode = encode
+        self.decode = decode
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        self.loader = loader
+
+        # Ordered from least to most recently used
+        self._sessions: "OrderedDict[int, Session]" = OrderedDict()
+        self._last_access: Dict[int, float] = {}
+        self._sizes: Dict[int, int] = {}
+
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            spilled = [int(name.split(".")[0]) for name in os.listdir(spill_dir) if name.split(".")[0].isdigit()]
+            first_id = max(first_id, max(spilled, default=0) + 1)
+        self._ids = itertools.count(first_id)
+
+        self.evicted = 0
+        self.expired = 0
+        self.spilled = 0
+        self.reloaded = 0
+        self.restored = 0
+
+    def create(self, session: Session) -> int:
+        session_id = next(self._ids)
+        self._store(session_id, session)
+        self._enforce_limit()
+        return session_id
+
+    def get(self, session_id: int) -> Optional[Session]:
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._reload(session_id) or self._restore(session_id)
+            if session is None:
+                return None
+        self._touch(session_id)
+        return session
+
+    def update(self, session_id: int, fn: Callable[[Session], Any]) -> Any:
+        session = self.get(session_id)
+        if session is None:
+            raise KeyError(session_id)
+        # Handlers run on one event loop thread and fn is synchronous, so this is atomic
+        result = fn(session)
+        if self.sizeof is not None:
+            self._sizes[session_id] = self.sizeof(session)
+        return result
+
+    def delete(self, session_id: int):
+        self._drop(session_id)
+        if self.spill_dir:
+            try:
+                os.remove(self._spill_path(session_id))
+            except FileNotFoundError:
+                pass
+
+    def ids(self) -> Iterator[int]:
+        return iter(list(self._sessions))
+
+    def __contains__(self, session_id: int) -> bool:
+        if session_id in self._sessions:
+            return True
+        if self.spill_dir and os.path.exists(self._spill_path(session_id)):
+            return True
+        return self.loader is not None and self.get(session_id) is not None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def sweep(self):
+        if self.idle_ttl is not None:
+            cutoff = time.monotonic() - self.idle_ttl
+            # Least recently used first, so stop at the first session that is still fresh
+            for session_id in list(self._sessions):
+                if self._last_access[session_id] > cutoff:
+                    break
+                self._evict(session_id)
+                self.expired += 1
+
+        if self.spill_dir:
+            cutoff = time.time() - self.spill_ttl
+            for name in os.listdir(self.spill_dir):
+                path = os.path.join(self.spill_dir, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def stats(self) -> Dict[str, Any]:
+        sizes = list(self._sizes.values())
+        return {
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "idle_ttl": self.idle_ttl,
+            "total_bytes": sum(sizes),
+            "avg_bytes": sum(sizes) / len(sizes) if sizes else 0,
+            "max_bytes": max(sizes, default=0),
+            "evicted": self.evicted,
+            "expired": self.expired,
+            "spilled": self.spilled,
+            "reloaded": self.reloaded,
+            "restored": self.restored,
+            "spilled_on_disk": len(os.listdir(self.spill_dir)) if self.spill_dir else 0,
+        }
+
+    # ---- Internals ----
+
+    def _store(self, session_id: int, session: Session):
+        self._sessions[session_id] = session
+        self._touch(session_id)
+        if self.sizeof is not None:
+            self._sizes[session_id] = self.sizeof(session)
+
+    def _touch(self, session_id: int):
+        self._sessions.move_to_end(session_id)
+        self._last_access[session_id] = time.monotonic()
+
+    def _drop(self, session_id: int):
+        self._sessions.pop(session_id, None)
+        self._last_access.pop(session_id, None)
+        self._sizes.pop(session_id, None)
+
+    def _enforce_limit(self):
+        while self.max_sessions is not None and len(self._sessions) > self.max_sessions:
+            session_id = next(iter(self._sessions))
+            self._evict(session_id)
+            self.evicted += 1
+
+    def _evict(self, session_id: int):
+        session = self._sessions[session_id]
+        if self.spill_dir:
+            path = self._spill_path(session_id)
+            with open(path + ".tmp", "wb") as f:
+                f.write(zlib.compress(json.dumps(self.encode(session), separators=(",", ":")).encode()))
+            os.replace(path + ".tmp", path)
+            self.spilled += 1
+        self._drop(session_id)
+        if self.on_evict is not None:
+            self.on_evict(session_id)
+
+    def _reload(self, session_id: int) -> Optional[Session]:
+        if not self.spill_dir:
+            return None
+        path = self._spill_path(session_id)
+        try:
+            with open(path, "rb") as f:
+                session = self.decode(json.loads(zlib.decompress(f.read())))
+        except FileNotFoundError:
+            return None
+        os.remove(path)
+        self.reloaded += 1
+        self._store(session_id, session)
+        self._enforce_limit()
+        return session
+
+    def _restore(self, session_id: int) -> Optional[Session]:
+        if self.loader is None:
+            return None
+        session = self.loader(session_id)
+        if session is None:
+            return None
+        self.restored += 1
+        self._store(session_id, session)
+        self._enforce_limit()
+        return session
+
+    def _spill_path(self, session_id: int) -> str:
+        return os.path.join(self.spill_dir, f"{int(session_id)}.json.z")
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Sessions shared between worker processes through a SQLite database in WAL mode.
+
+    Ids come from an AUTOINCREMENT column, so they never collide across workers.
+    Sessions are stored as zlib-compressed compact JSON; encode/decode convert between
+    the live session objects and plain JSON-able dicts. Sessions idle for longer than
+    idle_ttl are deleted by sweep(); byte counts are of the compressed rows.
+
+    Every query can wait up to 30s on another worker's write lock, and decoding a session
+    is proportional to its size, so the async methods run in a thread (each with its own
+    connection). An update's fn runs there too and must only touch the session.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        encode: Callable[[Session], Dict[str, Any]],
+        decode: Callable[[Dict[str, Any]], Session],
+        idle_ttl: Optional[float] = None,
+    ):
+        self.path = path
+        self.encode = encode
+        self.decode = decode
+        self.idle_ttl = idle_ttl
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "data BLOB NOT NULL, "
+                "updated_at REAL NOT NULL DEFAULT (julianday('now')))"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode: transactions are opened explicitly with BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _dumps(self, session: Session) -> bytes:
+        return zlib.compress(json.dumps(self.encode(session), separators=(",", ":")).encode())
+
+    def _loads(self, blob: bytes) -> Session:
+        return self.decode(json.loads(zlib.decompress(blob)))
+
+    def create(self, session: Session) -> int:
+        cursor = self._connect().execute("INSERT INTO sessions (data) VALUES (?)", (self._dumps(session),))
+        return cursor.lastrowid
+
+    def get(self, session_id: int) -> Optional[Session]:
+        row = self._connect().execute("SELECT data FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return self._loads(row[0]) if row else None
+
+    def update(self, session_id: int, fn: Callable[[Session], Any]) -> Any:
+        conn = self._connect()
+        # BEGIN IMMEDIATE takes the write lock up front, so the read-modify-write is atomic
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT data FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is None:
+                raise KeyError(session_id)
+            session = self._loads(row[0])
+            result = fn(session)
+            conn.execute(
+                "UPDATE sessions SET data = ?, updated_at = julianday('now') WHERE id = ?",
+                (self._dumps(session), session_id),
+            )
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def delete(self, session_id: int):
+        self._connect().execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def ids(self) -> Iterator[int]:
+        return iter([row[0] for row in self._connect().execute("SELECT id FROM sessions")])
+
+    def sweep(self):
+        if self.idle_ttl is not None:
+            self._connect().execute(
+                "DELETE FROM sessions WHERE updated_at < julianday('now') - ?", (self.idle_ttl / 86400,)
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        count, total, largest = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0), COALESCE(MAX(LENGTH(data)), 0) FROM sessions"
+        ).fetchone()
+        return {
+            "sessions": count,
+            "idle_ttl": self.idle_ttl,
+            "total_bytes": total,
+            "avg_bytes": total / count if count else 0,
+            "max_bytes": largest,
+        }
+
+    def __contains__(self, session_id: int) -> bool:
+        row = self._connect().execute("SELECT 1 FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    async def acreate(self, session: Session) -> int:
+        return await asyncio.to_thread(self.create, session)
+
+    async def aget(self, session_id: int) -> Optional[Session]:
+        return await asyncio.to_thread(self.get, session_id)
+
+    async def aupdate(self, session_id: int, fn: Callable[[Session], Any]) -> Any:
+        return await asyncio.to_thread(self.update, session_id, fn)
+
+    async def asweep(self):
+        await asyncio.to_thread(self.sweep)
@@ -0,0 +1,160 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from response_cache import normalize_question
+
+# (session id, character) -> {normalized question: (turn the answer was generated for, task)}
+SpeculationKey = Tuple[int, str]
+
+
+class Speculator:
+    """
+    Answers likely next questions in the background before the player asks them.
+
+    Each speculation is tied to the turn of the character's transcript it was generated
+    for; once another turn is recorded it no longer matches and is cancelled. Every
+    session has a token budget, at most max_concurrency speculative calls run at once,
+    and none are started while load() reports max_load or more other model calls in
+    flight, so speculative work always yields to real requests. For the same reason a real
+    request never waits on a speculation that hasn't reached the model yet, and waits at
+    most take_timeout for one that has.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = 6000,
+        max_concurrency: int = 2,
+        max_load: int = 8,
+        load: Callable[[], int] = lambda: 0,
+        poll_interval: float = 0.1,
+        take_timeout: float = 0.5,
+    ):
+        self.token_budget = token_budget
+        self.max_load = max_load
+        self.load = load
+        self.poll_interval = poll_interval
+        self.take_timeout = take_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._running = 0
+        # Speculations whose model call is under way (not paused waiting for capacity)
+        self._calling: Set[asyncio.Task] = set()
+        self._jobs: Dict[SpeculationKey, Dict[str, Tuple[int, asyncio.Task]]] = {}
+        self._spent: Dict[int, int] = {}
+
+        self.launched = 0
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+        self.abandoned = 0
+        self.over_budget = 0
+        self.tokens_spent = 0
+        self.saved_seconds = 0.0
+
+    def speculate(self, session_id: int, character: str, turn: int, question: str, cost: int, call: Callable[[], Awaitable[str]]) -> bool:
+        """Starts call() in the background as the answer to question, if the session can afford cost tokens"""
+        jobs = self._jobs.setdefault((session_id, character), {})
+        normalized = normalize_question(question)
+        if normalized in jobs and jobs[normalized][0] == turn:
+            return False
+        spent = self._spent.get(session_id, 0)
+        if spent + cost > self.token_budget:
+            self.over_budget += 1
+            return False
+
+        self._spent[session_id] = spent + cost
+        self.tokens_spent += cost
+        self.launched += 1
+        self._cancel(jobs.pop(normalized, None))
+        task = asyncio.create_task(self._run(call))
+        # Failures only mean a speculation miss; don't log them as unretrieved
+        task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        jobs[normalized] = (turn, task)
+        return True
+
+    async def take(self, session_id: int, character: str, turn: int, question: str) -> Optional[Tuple[str, float]]:
+        """
+        Returns (answer, seconds the model call took) if question was speculated for this
+        turn and the answer is ready (or its model call finishes within take_timeout), or None
+        so the caller makes the call itself.
+        """
+        jobs = self._jobs.get((session_id, character))
+        job = jobs.pop(normalize_question(question), None) if jobs else None
+        if job is None or job[0] != turn:
+            self._cancel(job)
+            self.misses += 1
+            return None
+
+        task = job[1]
+        if not task.done() and task in self._calling:
+            await asyncio.wait([task], timeout=self.take_timeout)
+        if not task.done():
+            # Still paused behind real requests, or too slow: don't make the player wait on it
+            self._cancel(job)
+            self.abandoned += 1
+            self.misses += 1
+            return None
+        if task.cancelled() or task.exception() is not None:
+            self.misses += 1
+            return None
+        answer, seconds = task.result()
+        self.hits += 1
+        self.saved_seconds += seconds
+        return answer, seconds
+
+    def discard(self, session_id: int, character: str, turn: Optional[int] = None):
+        """Cancels the character's speculations, except those generated for turn"""
+        jobs = self._jobs.get((session_id, character), {})
+        for question, job in list(jobs.items()):
+            if job[0] != turn:
+                self._cancel(jobs.pop(question))
+        if not jobs:
+            self._jobs.pop((session_id, character), None)
+
+    def drop_session(self, session_id: int):
+        for key in [key for key in self._jobs if key[0] == session_id]:
+            for job in self._jobs.pop(key).values():
+                self._cancel(job)
+        self._spent.pop(session_id, None)
+
+    async def stop(self):
+        tasks = [task for jobs in self._jobs.values() for _, task in jobs.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._jobs.clear()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "pending": sum(len(jobs) for jobs in self._jobs.values()),
+            "running": self._running,
+            "launched": self.launched,
+            "hits": self.hits,
+            "misses": self.misses,
+            "discarded": self.discarded,
+            "abandoned": self.abandoned,
+            "over_budget": self.over_budget,
+            "tokens_spent": self.tokens_spent,
+            "saved_seconds": self.saved_seconds,
+        }
+
+    def _cancel(self, job: Optional[Tuple[int, asyncio.Task]]):
+        if job is not None:
+            if not job[1].done():
+                job[1].cancel()
+            self.discarded += 1
+
+    async def _run(self, call: Callable[[], Awaitable[str]]) -> Tuple[str, float]:
+        async with self._semaphore:
+            # Wait until the real requests leave room for speculative ones
+            while self.load() - self._running >= self.max_load:
+                await asyncio.sleep(self.poll_interval)
+            self._running += 1
+            task = asyncio.current_task()
+            self._calling.add(task)
+            started = time.perf_counter()
+            try:
+                return await call(), time.perf_counter() - started
+            finally:
+                self._running -= 1
+                self._calling.discard(task)
@@ -0,0 +1,92 @@
+import json
+import re
+from typing import Any, Dict, Iterable, Iterator, Optional, Type
+
+from pydantic import BaseModel, create_model
+
+# Keys of a pydantic JSON schema that Gemini's responseSchema (an OpenAPI subset) accepts
+SCHEMA_KEYS = {"type", "properties", "required", "items", "enum", "description", "nullable", "format"}
+
+_decoder = json.JSONDecoder(strict=False)
+_trailing_comma = re.compile(r",(\s*[}\]])")
+_open_bracket = re.compile(r"[{\[]")
+
+
+def output_model(model: Type[BaseModel], exclude: Iterable[str] = ()) -> Type[BaseModel]:
+    """Derives the model the LLM should generate, without fields the backend fills in itself"""
+    exclude = set(exclude)
+    fields = {name: (info.annotation, info) for name, info in model.model_fields.items() if name not in exclude}
+    return create_model(f"{model.__name__}Output", **fields)
+
+
+def gemini_schema(model: Type[BaseModel], overrides: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """
+    Converts a pydantic model into a Gemini responseSchema: $refs are inlined and
+    unsupported keys dropped. overrides replaces the schema of top-level fields
+    (e.g. ones typed Any, which have no schema of their own).
+    """
+    schema = model.model_json_schema()
+    definitions = schema.get("$defs", {})
+
+    def convert(node: Dict[str, Any]) -> Dict[str, Any]:
+        if "$ref" in node:
+            node = definitions[node["$ref"].split("/")[-1]]
+        converted = {key: value for key, value in node.items() if key in SCHEMA_KEYS}
+        if "properties" in converted:
+            converted["properties"] = {name: convert(prop) for name, prop in converted["properties"].items()}
+        if "items" in converted:
+            converted["items"] = convert(converted["items"])
+        return converted
+
+    result = convert(schema)
+    for name, override in (overrides or {}).items():
+        result["properties"][name] = override
+    return result
+
+
+def json_candidates(text: str) -> Iterator[Any]:
+    """
+    Yields every top-level JSON object or array in a model response, in order. Tolerates
+    code fences, prose around and between them (including brackets, as in "the [JSON]:"),
+    raw newlines inside strings and trailing commas. Raises ValueError if there is none.
+    """
+    error: Optional[json.JSONDecodeError] = None
+    found = False
+    match = _open_bracket.search(text)
+    while match is not None:
+        start = match.start()
+        try:
+            value, end = _decoder.raw_decode(text, start)
+        except json.JSONDecodeError as e:
+            # Models sometimes copy the trailing commas from the example in the prompt
+            try:
+                value = _decoder.raw_decode(_trailing_comma.sub(r"\1", text[start:]))[0]
+            except json.JSONDecodeError:
+                error = error or e
+                match = _open_bracket.search(text, start + 1)
+                continue
+            # Offsets in the cleaned text don't map back, so carry on just past this bracket
+            end = start + 1
+        found = True
+        yield value
+        match = _open_bracket.search(text, end)
+
+    if not found:
+        if error is None:
+            raise ValueError("No JSON object found in the response")
+        raise ValueError(f"Invalid JSON in the response - {str(error)}")
+
+
+def parse_structured(text: str, model: Type[BaseModel]) -> Dict[str, Any]:
+    """
+    Returns the first JSON value in the response that validates against the model, so a
+    bracketed aside such as "[1]" before the real object doesn't cost a repair call
+    """
+    first_error: Optional[ValueError] = None
+    for data in json_candidates(text):
+        try:
+            model.model_validate(data)
+            return data
+        except ValueError as e:
+            first_error = first_error or e
+    raise first_error
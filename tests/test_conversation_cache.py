@@ -0,0 +1,59 @@
+import json
+import os
+import sys
+import time
+
+import httpx
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backend
+from scenario_pool import ScenarioPool
+
+KEY = (3, "supermarket", "poison")
+SCENARIO = {
+    "background": "The manager was found dead in the stockroom.",
+    "characters": [{"name": "Alice", "description": "The cashier"}, {"name": "Bob", "description": "The butcher"}],
+    "ground_truth": {"killer": "Bob", "method": "poison", "motive": "debt", "timeline": ["9pm"], "clues": ["vial"]},
+}
+
+
+def test_players_on_a_pooled_scenario_share_answers(monkeypatch):
+    chat_calls = []
+
+    def handler(request):
+        chat_calls.append(request.url.path)
+        answer = f"Answer {len(chat_calls)}"
+        return httpx.Response(200, json={"candidates": [{"content": {"parts": [{"text": answer}]}}]})
+
+    builds = []
+
+    async def build(*key):
+        # Every build is a different mystery, as with the real model
+        builds.append(key)
+        scenario = json.loads(json.dumps(SCENARIO))
+        scenario["background"] += f" ({len(builds)})"
+        return scenario
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(backend.gemini, "_get_client", lambda: client)
+    monkeypatch.setattr(backend, "scenario_pool", ScenarioPool(build, {KEY: 1}, shares=2))
+    # Keep context caching (a separate API) out of the test
+    monkeypatch.setattr(backend.context_cache, "min_tokens", 10 ** 9)
+
+    with TestClient(backend.app) as api:
+        deadline = time.time() + 5
+        while backend.scenario_pool.stats()["depth"]["|".join(map(str, KEY))]["ready"] < 1 and time.time() < deadline:
+            time.sleep(0.01)
+
+        story = {"difficulty": KEY[0], "setting": KEY[1], "murder_mode": KEY[2]}
+        players = [api.post("/story/generate", json=story).json()["user_id"] for _ in range(2)]
+        answers = [
+            api.post("/conversation", json={"user_id": user_id, "character": "Alice", "question": "Where were you?"}).json()
+            for user_id in players
+        ]
+
+    assert backend.scenario_pool.hits == 2
+    assert answers == ["Answer 1", "Answer 1"]
+    assert len(chat_calls) == 1
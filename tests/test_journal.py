@@ -0,0 +1,107 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from journal import SessionJournal
+
+
+def apply(session, event):
+    if event["op"] == "create":
+        # A replayed create would hide events applied twice
+        assert session is None, "session created twice"
+        return {"turns": list(event["session"]["turns"])}
+    session["turns"].append(event["turn"])
+    return session
+
+
+def encode(session):
+    return {"turns": list(session["turns"])}
+
+
+def open_journal(directory, **kwargs):
+    return SessionJournal(str(directory), apply, encode, **kwargs)
+
+
+def write(directory, events, **kwargs):
+    """Records (session id, event) pairs one batch at a time and shuts the journal down cleanly"""
+    journal = open_journal(directory, **kwargs)
+
+    async def run():
+        journal.start()
+        for session_id, event in events:
+            journal.record(session_id, event)
+            # Let the writer flush (and maybe compact) before the next batch
+            await asyncio.sleep(0.01)
+        await journal.stop()
+
+    asyncio.run(run())
+    return journal
+
+
+def game(session_id, turns):
+    return [(session_id, {"op": "create", "session": {"turns": []}})] + [
+        (session_id, {"op": "turn", "turn": turn}) for turn in turns
+    ]
+
+
+def segments(directory):
+    return sorted(name for name in os.listdir(directory) if name.startswith("segment-"))
+
+
+def test_reopen_replays_the_log(tmp_path):
+    directory = str(tmp_path)
+    write(directory, game(1, ["a", "b"]) + game(2, ["c"]))
+
+    journal = open_journal(directory)
+    assert journal.load(1) == {"turns": ["a", "b"]}
+    assert journal.load(2) == {"turns": ["c"]}
+    assert journal.load(3) is None
+    assert journal.max_id == 2
+    assert journal.seq == 5
+
+
+def test_torn_last_line_is_dropped(tmp_path):
+    directory = str(tmp_path)
+    write(directory, game(1, ["a", "b"]))
+    with open(os.path.join(directory, segments(directory)[-1]), "a") as f:
+        f.write('4\t1\t{"op":"turn","tu')
+
+    journal = open_journal(directory)
+    assert journal.load(1) == {"turns": ["a", "b"]}
+    assert journal.seq == 3
+
+    # New events go to a fresh segment, never after the torn line (which compaction drops)
+    write(directory, [(1, {"op": "turn", "turn": "c"})])
+    assert segments(directory) == ["segment-00000002.log"]
+    assert open_journal(directory).load(1) == {"turns": ["a", "b", "c"]}
+
+
+def test_compaction_keeps_snapshot_and_tail(tmp_path):
+    directory = str(tmp_path)
+    journal = write(directory, game(1, ["a", "b", "c"]), compact_bytes=1)
+    assert journal.compactions >= 1
+    assert os.path.exists(os.path.join(directory, "snapshots", "1.json.z"))
+
+    reopened = open_journal(directory)
+    assert reopened.load(1) == {"turns": ["a", "b", "c"]}
+    # Ids and sequence numbers continue after compaction, even once the log is gone
+    assert reopened.max_id == 1
+    assert reopened.seq == 4
+
+
+def test_segments_left_behind_by_a_crash_are_not_replayed_twice(tmp_path):
+    directory = str(tmp_path)
+    write(directory, game(1, ["a", "b"]))
+    saved = {name: open(os.path.join(directory, name)).read() for name in segments(directory)}
+
+    # Compacting at startup folds the old log into snapshots and removes it
+    write(directory, [(1, {"op": "turn", "turn": "c"})], compact_bytes=1)
+    assert not set(saved) & set(segments(directory))
+
+    # A crash right after the snapshots and checkpoint are on disk but before the segments go
+    for name, data in saved.items():
+        with open(os.path.join(directory, name), "w") as f:
+            f.write(data)
+    assert open_journal(directory).load(1) == {"turns": ["a", "b", "c"]}
@@ -0,0 +1,47 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from response_cache import ResponseCache
+
+BUCKET = ("scenario", "Alice", "history")
+
+# Questions that differ in exactly the word the answer depends on
+NEAR_MISSES = [
+    ("Did you see Alice near the pool last night?", "Did you see Bob near the pool last night?"),
+    ("Where were you on Friday night?", "Where were you on Saturday night?"),
+    ("Were you in the kitchen when the lights went out?", "Were you in the garage when the lights went out?"),
+]
+
+
+def same_vector(text):
+    # Worst case: an embedding that considers every question identical
+    return [1.0, 0.0]
+
+
+def test_exact_match_after_normalization():
+    cache = ResponseCache()
+    cache.store(*BUCKET, "Where were you last night?", "At home.", 1.0)
+    assert cache.lookup(*BUCKET, "where were you, last night") == "At home."
+
+
+def test_near_misses_are_not_matched_by_default():
+    cache = ResponseCache()
+    for cached, asked in NEAR_MISSES:
+        cache.store(*BUCKET, cached, "cached answer", 1.0)
+        assert cache.lookup(*BUCKET, asked) is None
+
+
+def test_near_misses_are_not_matched_by_similarity():
+    cache = ResponseCache(similarity_threshold=0.85, embed=same_vector)
+    for cached, asked in NEAR_MISSES:
+        cache.store(*BUCKET, cached, "cached answer", 1.0)
+        assert cache.lookup(*BUCKET, asked) is None
+
+
+def test_rephrasing_with_same_content_words_is_matched_by_similarity():
+    cache = ResponseCache(similarity_threshold=0.85, embed=same_vector)
+    cache.store(*BUCKET, "Did you see Bob near the pool?", "No.", 1.0)
+    assert cache.lookup(*BUCKET, "Bob, did you see him near the pool?") == "No."
+    assert cache.stats()["semantic_hits"] == 1
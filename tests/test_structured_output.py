@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pytest
+from pydantic import BaseModel
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from structured_output import json_candidates, parse_structured
+
+
+class Verdict(BaseModel):
+    killer: str
+    clues: list
+
+
+def test_prose_brackets_are_skipped():
+    text = 'Here is the [JSON] you asked for:\n```json\n{"killer": "Bob", "clues": ["vial"]}\n```'
+    assert list(json_candidates(text)) == [{"killer": "Bob", "clues": ["vial"]}]
+
+
+def test_trailing_commas_are_tolerated():
+    text = '{"killer": "Bob", "clues": ["vial", "glove",],}'
+    assert next(json_candidates(text)) == {"killer": "Bob", "clues": ["vial", "glove"]}
+
+
+def test_no_json_raises():
+    with pytest.raises(ValueError, match="No JSON"):
+        next(json_candidates("I refuse to answer."))
+    with pytest.raises(ValueError, match="Invalid JSON"):
+        next(json_candidates('{"killer": }'))
+
+
+def test_first_value_that_validates_wins():
+    text = 'See note [1]. {"killer": "Bob", "clues": []}'
+    assert parse_structured(text, Verdict) == {"killer": "Bob", "clues": []}
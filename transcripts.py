@@ -0,0 +1,115 @@
+from collections import deque
+from typing import Any, Deque, Dict, Tuple
+
+from prompts import format_conversation_turn, format_conversation_summary
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)"""
+    return len(text) // 4 + 1
+
+
+class Transcript:
+    """
+    One character's side of the interrogation.
+
+    Turns are rendered once when they are appended, so building a prompt is a single
+    join instead of a rescan of the whole game history. Once the rendered turns go over
+    the token budget, the oldest ones are folded into a running summary.
+    """
+
+    def __init__(self, character: str, token_budget: int = 1500, keep_recent: int = 4):
+        self.character = character
+        self.token_budget = token_budget
+        self.keep_recent = keep_recent
+        self.summary = ""
+        self.turns: Deque[Tuple[str, int]] = deque()   # (rendered turn, tokens)
+        self.tokens = 0
+        self.offset = 0   # number of turns folded into the summary (or dropped) so far
+
+    def append(self, question: str, answer: str):
+        turn = format_conversation_turn(self.character, question, answer)
+        tokens = estimate_tokens(turn)
+        self.turns.append((turn, tokens))
+        self.tokens += tokens
+
+    @property
+    def turn_count(self) -> int:
+        """Turns asked so far, including the summarized and dropped ones"""
+        return self.offset + len(self.turns)
+
+    def render(self) -> str:
+        summary = format_conversation_summary(self.summary) if self.summary else ""
+        return summary + "".join(turn for turn, _ in self.turns)
+
+    def over_budget(self) -> bool:
+        return self.tokens > self.token_budget and len(self.turns) > self.keep_recent
+
+    def pending_summary(self) -> Tuple[int, int, str]:
+        """
+        Returns (offset, count, rendered turns) for the oldest turns that should be folded
+        into the summary. offset identifies the transcript state the summary was built from.
+        """
+        count = len(self.turns) - self.keep_recent
+        return self.offset, count, "".join(self.turns[i][0] for i in range(count))
+
+    def apply_summary(self, offset: int, count: int, summary: str) -> bool:
+        """Replaces the summarized turns with the new summary, unless someone else already did"""
+        if offset != self.offset or count > len(self.turns):
+            return False
+        # New turns are only ever appended, so the summarized ones are still at the front
+        for _ in range(count):
+            _, tokens = self.turns.popleft()
+            self.tokens -= tokens
+        self.offset += count
+        self.summary = summary.strip()
+        return True
+
+    def truncate(self):
+        """Drops the oldest turns once the transcript is past twice its budget (summarization fallback)"""
+        while self.tokens > 2 * self.token_budget and len(self.turns) > self.keep_recent:
+            _, tokens = self.turns.popleft()
+            self.tokens -= tokens
+            self.offset += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"summary": self.summary, "offset": self.offset, "turns": [turn for turn, _ in self.turns]}
+
+    @classmethod
+    def from_dict(cls, character: str, data: Dict[str, Any], token_budget: int, keep_recent: int) -> "Transcript":
+        transcript = cls(character, token_budget, keep_recent)
+        transcript.summary = data["summary"]
+        transcript.offset = data["offset"]
+        for turn in data["turns"]:
+            tokens = estimate_tokens(turn)
+            transcript.turns.append((turn, tokens))
+            transcript.tokens += tokens
+        return transcript
+
+
+class TranscriptStore:
+    """Per-session store of transcripts, one per character"""
+
+    def __init__(self, token_budget: int = 1500, keep_recent: int = 4):
+        self.token_budget = token_budget
+        self.keep_recent = keep_recent
+        self.transcripts: Dict[str, Transcript] = {}
+
+    def get(self, character: str) -> Transcript:
+        if character not in self.transcripts:
+            self.transcripts[character] = Transcript(character, self.token_budget, self.keep_recent)
+        return self.transcripts[character]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "token_budget": self.token_budget,
+            "keep_recent": self.keep_recent,
+            "transcripts": {character: transcript.to_dict() for character, transcript in self.transcripts.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "TranscriptStore":
+        store = cls(data["token_budget"], data["keep_recent"])
+        for character, transcript in data["transcripts"].items():
+            store.transcripts[character] = Transcript.from_dict(character, transcript, store.token_budget, store.keep_recent)
+        return store